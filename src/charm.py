@@ -4,31 +4,91 @@
 
 """GLAuth Operator Charm."""
 
+import json
 import logging
+import time
+from typing import Optional
 
 import glauth
+import instrumentation
+import probe
+import profiling
+import snapd
 from charms.operator_libs_linux.v1 import snap
-from ldapclient_lib import ConfigDataUnavailableEvent, LdapClientProvides, LdapReadyEvent
+from ldapclient_lib import (
+    CREDENTIALS_LABEL,
+    SECRET_KEYS,
+    ConfigDataUnavailableEvent,
+    LdapClientProvides,
+    LdapClientRequires,
+    LdapReadyEvent,
+    credentials_content,
+)
 from ops.charm import CharmBase
+from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.model import (
+    ActiveStatus,
+    BlockedStatus,
+    MaintenanceStatus,
+    Secret,
+    SecretNotFoundError,
+    WaitingStatus,
+)
 
 logger = logging.getLogger(__name__)
 
+# snapd holds refreshes for at most 90 days
+HOLD_DAYS = 90
 
+instrumentation.install()
+instrumentation.instrument("_on_relation_joined", "_on_relation_broken")(LdapClientProvides)
+instrumentation.instrument("_on_relation_changed", "_on_relation_broken", "_on_secret_changed")(
+    LdapClientRequires
+)
+
+
+@instrumentation.instrument(
+    "_install",
+    "_on_config_changed",
+    "_remove",
+    "_update_status",
+    "_upgrade_charm",
+    "_on_set_confidential_action",
+    "_on_hook_stats_action",
+    "_on_profile_top_action",
+    "_on_config_data_unavailable",
+    "_on_ldap_ready",
+)
 class GlauthCharm(CharmBase):
     """Charmed Operator to deploy glauth - a lightweight LDAP server."""
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
+        self._stored.set_default(
+            snap_change=None,
+            refresh_skipped=None,
+            workload_revision=None,
+            tls_key_type=None,
+            glauth_state=None,
+            hold_expiry=None,
+            time_to_ready={},
+            hook_stats=[],
+        )
         self._ldapclient = LdapClientProvides(self, "ldap-client")
         # Observe common Juju events
         self.framework.observe(self.on.install, self._install)
+        self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.remove, self._remove)
         self.framework.observe(self.on.update_status, self._update_status)
         self.framework.observe(self.on.upgrade_charm, self._upgrade_charm)
         # Actions
         self.framework.observe(self.on.set_confidential_action, self._on_set_confidential_action)
+        self.framework.observe(self.on.hook_stats_action, self._on_hook_stats_action)
+        self.framework.observe(self.on.profile_top_action, self._on_profile_top_action)
+        self.framework.observe(self.framework.on.pre_commit, self._on_pre_commit)
         # LDAP Client Lib Integrations
         self.framework.observe(
             self._ldapclient.on.config_data_unavailable,
@@ -43,41 +103,227 @@ class GlauthCharm(CharmBase):
         """Install glauth."""
         self.unit.status = MaintenanceStatus("installing glauth")
         try:
-            glauth.install()
-            self.unit.set_workload_version(glauth.version())
-            self.unit.status = ActiveStatus()
+            self._follow_snap_change(glauth.install(wait=False))
+        except snap.SnapError as e:
+            self.unit.status = BlockedStatus(e.message)
+
+    def _follow_snap_change(self, change: Optional[str]) -> None:
+        """Record a submitted snapd change, or finish at once if snapd had nothing to do.
+
+        Args:
+            change: The snapd change ID, None if the snap was already as requested.
+        """
+        self._stored.snap_change = change
+        if change is None:
+            self._snap_change_done()
+
+    def _check_snap_change(self) -> bool:
+        """Follow up on a pending glauth snap install or refresh.
+
+        Returns:
+            bool: True once no snapd change is pending.
+        """
+        if self._stored.snap_change is None:
+            return True
+        try:
+            ready, progress = glauth.change_progress(self._stored.snap_change)
         except snap.SnapError as e:
+            self._stored.snap_change = None
             self.unit.status = BlockedStatus(e.message)
+            return False
+        if not ready:
+            self.unit.status = MaintenanceStatus(f"waiting for glauth snap: {progress}")
+            return False
+
+        logger.info("snapd change %s done: %s", self._stored.snap_change, progress)
+        self._stored.snap_change = None
+        self._snap_change_done()
+        return True
+
+    def _snap_change_done(self) -> None:
+        """Renew the refresh hold and report the new version once the snap is in place."""
+        self._hold_refresh(force=True)
+        self._update_workload_version()
+        self.unit.status = ActiveStatus()
+
+    def _on_config_changed(self, _) -> None:
+        """Handle config-changed event."""
+        profiling.enable(
+            self.charm_dir,
+            self.config["profile-threshold"] if self.config["profile-hooks"] else None,
+        )
+        key_type = self.config["tls-key-type"]
+        if key_type not in glauth.KEY_TYPES:
+            self.unit.status = BlockedStatus(f"invalid tls-key-type {key_type}")
+            return
+        # No certificate generated yet, or already of the right type
+        if self._stored.tls_key_type not in (None, key_type):
+            logger.info("replacing %s certificate with %s", self._stored.tls_key_type, key_type)
+            ca_cert = glauth.load(key_type=key_type, regenerate=True)
+            self._stored.tls_key_type = key_type
+            self._update_ca_cert(ca_cert)
+
+        # Propagate tls, api-port and ldap-search-base to all ldap-client relations
+        self._ldapclient.reconcile()
 
     def _on_config_data_unavailable(self, event: ConfigDataUnavailableEvent) -> None:
         """Handle config-data-unavailable event."""
         # If config data is unavailable, set default config
-        glauth.create_default_config(api_port=event.api_port)
+        changed = glauth.create_default_config(
+            api_port=event.api_port,
+            tls=self.config["tls"],
+            bytecode_cache_dir=str(self.charm_dir / ".template-cache"),
+        )
+        logger.debug("default config %s", "updated" if changed else "unchanged")
 
     def _on_ldap_ready(self, event: LdapReadyEvent) -> None:
         """Handle ldap-ready event."""
-        glauth.start()
-        self.unit.status = ActiveStatus()
+        if not self._reconcile():
+            self._ldapclient.set_server_ready(False)
+            event.defer()
+
+    def _reconcile(self) -> bool:
+        """Bring the glauth daemon in line with its rendered config.
+
+        The config, listener and TLS state last applied is kept in stored state, so the
+        daemon is only reloaded or restarted when something it depends on changed.
+
+        Returns:
+            bool: False if a pending snapd change has to finish first.
+        """
+        if not self._check_snap_change():
+            return False
+        start = time.monotonic()
+        applied = self._stored.glauth_state
+        action, state = glauth.reconcile(dict(applied) if applied else None)
+        logger.info("glauth config reconciled: %s", action)
+        self._stored.glauth_state = state
+        if action in ("start", "restart"):
+            # Clients are only told about the server once it accepts connections
+            try:
+                glauth.wait_ready(tls=self.config["tls"])
+            except TimeoutError as e:
+                logger.warning("%s", e)
+                self._ldapclient.set_server_ready(False)
+                self.unit.status = WaitingStatus(str(e))
+                return True
+            self._record_time_to_ready(time.monotonic() - start)
+        self._ldapclient.set_server_ready(True)
+        self._probe()
+        return True
+
+    def _record_time_to_ready(self, seconds: float) -> None:
+        """Log and store how long glauth took to accept connections, per snap revision."""
+        try:
+            revision = glauth.revision()
+        except snap.SnapError:
+            revision = "unknown"
+        logger.info("glauth revision %s ready after %.2fs", revision, seconds)
+        self._stored.time_to_ready[revision] = round(seconds, 3)
+
+    def _probe(self) -> None:
+        """Set the unit status from the latency of the LDAP port advertised to clients.
+
+        Clients are only given the server while that port answers.
+        """
+        tls = self.config["tls"]
+        port = glauth.LDAPS_PORT if tls else glauth.LDAP_PORT
+        try:
+            result = probe.probe(glauth.LOCAL_HOST, port, tls=tls)
+        except probe.ProbeUnreachableError as e:
+            self._ldapclient.set_server_ready(False)
+            self.unit.status = WaitingStatus(str(e))
+            return
+        except probe.ProbeError as e:
+            self._ldapclient.set_server_ready(False)
+            self.unit.status = BlockedStatus(str(e))
+            return
+        self._ldapclient.set_server_ready(True)
+        self.unit.status = ActiveStatus(
+            "ldap p50 {:.1f}ms max {:.1f}ms".format(result.p50 * 1000, result.max * 1000)
+        )
 
     def _on_set_confidential_action(self, event):
         """Handle the set-confidential action."""
         if "ca-cert" in event.params:
             cc_content = {"ca-cert": event.params["ca-cert"]}
         else:
-            cc_content = {"ca-cert": glauth.load()}
-        ldbd_content = {"ldap-default-bind-dn": event.params["ldap-default-bind-dn"]}
-        lp_content = {"ldap-password": event.params["ldap-password"]}
-        cc_secret = self.app.add_secret(cc_content, label="ca-cert")
-        logger.debug("created secret ca-cert")
-        ldbd_secret = self.app.add_secret(ldbd_content, label="ldap-default-bind-dn")
-        logger.debug("created secret ldap-default-bind-dn")
-        lp_secret = self.app.add_secret(lp_content, label="ldap-password")
-        logger.debug("created secret ldap-password")
-        # Get peer integration to store secrets
+            key_type = event.params.get("key-type", self.config["tls-key-type"])
+            cc_content = {"ca-cert": glauth.load(key_type=key_type)}
+            self._stored.tls_key_type = key_type
+        content = credentials_content(
+            ca_cert=cc_content["ca-cert"],
+            default_bind_dn=event.params["ldap-default-bind-dn"],
+            password=event.params["ldap-password"],
+        )
+        # Rotate the existing secret in place, so consumers get secret-changed
         ldap_relation = self.model.get_relation("glauth")
-        ldap_relation.data[self.app]["ca-cert"] = cc_secret.id
-        ldap_relation.data[self.app]["ldap-default-bind-dn"] = ldbd_secret.id
-        ldap_relation.data[self.app]["ldap-password"] = lp_secret.id
+        try:
+            secret = self.model.get_secret(label=CREDENTIALS_LABEL)
+            self._set_secret_content(secret, content)
+            secret_id = ldap_relation.data[self.app].get(CREDENTIALS_LABEL)
+            secret_id = secret_id or secret.get_info().id
+        except SecretNotFoundError:
+            secret_id = self.app.add_secret(content, label=CREDENTIALS_LABEL).id
+            logger.debug("created secret %s", CREDENTIALS_LABEL)
+        # Get peer integration to store secrets, replacing those of older releases
+        if ldap_relation.data[self.app].get(CREDENTIALS_LABEL) != secret_id:
+            ldap_relation.data[self.app].update(
+                {CREDENTIALS_LABEL: secret_id, **dict.fromkeys(SECRET_KEYS, "")}
+            )
+        for label in SECRET_KEYS:
+            try:
+                self.model.get_secret(label=label).remove_all_revisions()
+                logger.debug("removed secret %s", label)
+            except SecretNotFoundError:
+                continue
+        self._ldapclient.reconcile()
+
+    def _set_secret_content(self, secret: Secret, content: dict) -> bool:
+        """Add a revision to an owned secret, unless its latest revision already holds content.
+
+        Returns:
+            bool: True if a new revision was created.
+        """
+        if secret.peek_content() == content:
+            logger.debug("secret %s unchanged", secret.label)
+            return False
+        secret.set_content(content)
+        logger.debug("new revision of secret %s", secret.label)
+        return True
+
+    def _update_ca_cert(self, ca_cert: str) -> None:
+        """Share a new CA certificate through whichever secret layout is in use."""
+        try:
+            secret = self.model.get_secret(label=CREDENTIALS_LABEL)
+            self._set_secret_content(secret, {**secret.peek_content(), "ca-cert": ca_cert})
+            return
+        except SecretNotFoundError:
+            pass
+        try:
+            secret = self.model.get_secret(label="ca-cert")
+            self._set_secret_content(secret, {"ca-cert": ca_cert})
+        except SecretNotFoundError:
+            logger.debug("no ca-cert secret to update")
+
+    def _on_hook_stats_action(self, event):
+        """Handle the hook-stats action."""
+        event.set_results(instrumentation.percentiles(list(self._stored.hook_stats)))
+
+    def _on_profile_top_action(self, event):
+        """Handle the profile-top action."""
+        path = profiling.latest(self.charm_dir)
+        if path is None:
+            event.fail("no slow hook profiled")
+            return
+        event.set_results({"file": path.name, "top": profiling.top(path, event.params["count"])})
+
+    def _on_pre_commit(self, _):
+        """Log what the hook spent its time on, and keep it for hook-stats."""
+        record = instrumentation.summary()
+        logger.info("hook-stats %s", json.dumps(record, sort_keys=True))
+        window = list(self._stored.hook_stats)[1 - instrumentation.WINDOW :]
+        self._stored.hook_stats = window + [record]
 
     def _remove(self, _):
         """Remove glauth from the machine."""
@@ -86,17 +332,53 @@ class GlauthCharm(CharmBase):
 
     def _update_status(self, _):
         """Update status."""
-        snap.hold_refresh()
+        if self._stored.snap_change is not None:
+            self._check_snap_change()
+            return
+        self._hold_refresh()
+        self._update_workload_version()
+        if self._stored.glauth_state is not None:
+            self._probe()
+
+    def _hold_refresh(self, force: bool = False) -> None:
+        """Hold snap refreshes, unless the current hold is not yet due for renewal.
+
+        Args:
+            force: Renew the hold regardless of its expiry.
+        """
+        window = self.config["refresh-hold-renew-days"] * 86400
+        expiry = self._stored.hold_expiry
+        if not force and expiry is not None and time.time() < expiry - window:
+            return
+        snapd.hold_refresh(days=HOLD_DAYS, backend=snapd.SnapBackend.API)
+        self._stored.hold_expiry = time.time() + HOLD_DAYS * 86400
+
+    def _update_workload_version(self) -> None:
+        """Set the workload version, unless the snap revision has not changed since last time."""
+        revision = glauth.revision()
+        if revision == self._stored.workload_revision:
+            return
         self.unit.set_workload_version(glauth.version())
+        self._stored.workload_revision = revision
 
     def _upgrade_charm(self, _):
         """Ensure the snap is refreshed (in channel) if there are new revisions."""
+        try:
+            reason = glauth.refresh_skip_reason()
+        except snap.SnapError as e:
+            self.unit.status = BlockedStatus(e.message)
+            return
+        self._stored.refresh_skipped = reason
+        if reason:
+            logger.info("not refreshing glauth: %s", reason)
+            return
+
         self.unit.status = MaintenanceStatus("refreshing glauth")
         try:
-            glauth.refresh()
+            self._follow_snap_change(glauth.refresh(wait=False))
         except snap.SnapError as e:
             self.unit.status = BlockedStatus(e.message)
 
 
 if __name__ == "__main__":  # pragma: nocover
-    main(GlauthCharm)
+    profiling.run(main, GlauthCharm)
@@ -4,20 +4,98 @@
 
 """Provides glauth class to control glauth."""
 
+import datetime
+import functools
+import hashlib
 import logging
+import os
 import pathlib
 import socket
-import subprocess
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
 
+import probe
+import snapd
+import toml
 from charms.operator_libs_linux.v1 import snap
-from jinja2 import Template
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import NameOID
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 logger = logging.getLogger(__name__)
 
+# Change to stable once stable is released
+CHANNEL = "latest/edge"
 
-def _snap():
-    cache = snap.SnapCache()
-    return cache["glauth"]
+CONFIG_PATH = "/var/snap/glauth/common/etc/glauth/glauth.d/glauth.cfg"
+TEMPLATES_DIR = "templates"
+CERT_PATH = "/var/snap/glauth/common/etc/glauth/certs.d/glauth.crt"
+KEY_PATH = "/var/snap/glauth/common/etc/glauth/keys.d/glauth.key"
+# snapd points this at the mounted revision, e.g. 42 or x1 for a sideloaded snap
+CURRENT_PATH = "/snap/glauth/current"
+LDAP_PORT = 363
+LDAPS_PORT = 636
+# glauth listens on all IPv4 addresses
+LOCAL_HOST = "127.0.0.1"
+READY_TIMEOUT = 30.0
+# Config sections and keys glauth only reads when it starts
+LISTENER_SECTIONS = ("ldap", "ldaps", "api", "frontend")
+RESTART_KEYS = ("enabled", "listen", "tls", "cert", "key")
+KEY_TYPES = ("rsa-2048", "rsa-3072", "rsa-4096", "ecdsa-p256", "ecdsa-p384", "ed25519")
+
+# Process-wide snapd client and snap cache, shared by every call made during a single hook
+_client: Optional[snapd.SnapClient] = None
+_cache: Optional[snapd.SnapCache] = None
+_cache_stats = {"hits": 0, "misses": 0}
+# Revisions published in each store channel, looked up at most once per hook
+_store_revisions: Optional[Dict[str, str]] = None
+
+
+def _snap_client() -> snapd.SnapClient:
+    global _client
+    if _client is None:
+        _client = snapd.SnapClient()
+    return _client
+
+
+def _snap() -> snapd.Snap:
+    global _cache
+    if _cache is None:
+        _cache_stats["misses"] += 1
+        _cache = snapd.SnapCache(names=["glauth"], snap_client=_snap_client())
+    else:
+        _cache_stats["hits"] += 1
+    return _cache["glauth"]
+
+
+def _store_revision(channel: str) -> Optional[str]:
+    global _store_revisions
+    if _store_revisions is None:
+        info = _snap_client().get_snap_information("glauth")
+        _store_revisions = {
+            name: str(release.get("revision"))
+            for name, release in info.get("channels", {}).items()
+        }
+    return _store_revisions.get(channel)
+
+
+def _full_channel(channel: str) -> str:
+    """Return the channel with its track, e.g. 'edge' -> 'latest/edge'."""
+    return channel if "/" in channel else f"latest/{channel}"
+
+
+def cache_stats() -> Dict[str, int]:
+    """Return the hit and miss counters of the glauth snap cache."""
+    return dict(_cache_stats)
+
+
+def invalidate() -> None:
+    """Drop the cached snap state so the next call reloads it from snapd."""
+    global _cache
+    _cache = None
 
 
 def active() -> bool:
@@ -25,24 +103,141 @@ def active() -> bool:
     return bool(_snap().services["daemon"]["active"])
 
 
-def create_default_config(api_port: int) -> None:
-    """Create default config with no users."""
-    template = Template(pathlib.Path("templates/glauth.toml.j2").read_text())
+def change_progress(change_id: str) -> Tuple[bool, str]:
+    """Check on a snapd change submitted by `install` or `refresh`.
 
-    rendered = template.render(api_port=api_port, ldap_port=363)
-    pathlib.Path("/var/snap/glauth/common/etc/glauth/glauth.d/glauth.cfg").write_text(rendered)
+    Args:
+        change_id: the snapd change ID.
 
+    Returns:
+        Tuple[bool, str]: Whether the change is done, and a short progress summary.
+
+    Raises:
+        SnapError: If the change failed or snapd could not be queried.
+    """
+    try:
+        change = _snap_client().get_change(change_id)
+    except snap.SnapAPIError as e:
+        raise snap.SnapError(f"could not query snapd change {change_id}: {e.message}")
+
+    if change.get("ready"):
+        invalidate()
+        if change.get("status") != "Done":
+            raise snap.SnapError(f"snapd change {change_id} failed: {change.get('err', '')}")
+        return True, change.get("summary", "")
+
+    tasks = change.get("tasks", [])
+    done = sum(1 for task in tasks if task.get("status") == "Done")
+    progress = f"{done}/{len(tasks)} tasks"
+    current = next((task for task in tasks if task.get("status") == "Doing"), None)
+    if current:
+        progress = f"{progress}, {current.get('summary', '')}".rstrip(", ")
+        counts = current.get("progress", {})
+        if counts.get("total", 0) > 1:
+            progress = f"{progress} {100 * counts['done'] // counts['total']}%"
+    return False, progress
 
-def install() -> None:
-    """Install glauth snap."""
+
+@functools.lru_cache(maxsize=None)
+def _environment(bytecode_cache_dir: Optional[str] = None) -> Environment:
+    """Return the template environment; templates are compiled once per process."""
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        pathlib.Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+    return Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR), bytecode_cache=bytecode_cache, auto_reload=False
+    )
+
+
+def write_if_changed(path: pathlib.Path, content: str, mode: int = 0o644) -> bool:
+    """Atomically write content to path, unless the file already holds exactly that.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    data = content.encode()
     try:
-        # Change to stable once stable is released
-        _snap().ensure(snap.SnapState.Latest, channel="edge")
-        snap.hold_refresh()
+        current = hashlib.sha256(path.read_bytes()).digest()
+    except FileNotFoundError:
+        current = None
+    if current == hashlib.sha256(data).digest():
+        return False
+    _write_atomic(path, data, mode)
+    return True
+
+
+def render(template: str, path: str, bytecode_cache_dir: Optional[str] = None, **context) -> bool:
+    """Render a template to path, writing only if the output changed.
+
+    Args:
+        template: Template name, relative to TEMPLATES_DIR.
+        path: Destination file.
+        bytecode_cache_dir: Optional directory to keep compiled templates in across processes.
+        context: Template variables.
+
+    Returns:
+        bool: Whether the destination file changed.
+    """
+    rendered = _environment(bytecode_cache_dir).get_template(template).render(**context)
+    changed = write_if_changed(pathlib.Path(path), rendered)
+    logger.debug("%s %s", "wrote" if changed else "unchanged", path)
+    return changed
+
+
+def create_default_config(
+    api_port: int, tls: bool = False, bytecode_cache_dir: Optional[str] = None
+) -> bool:
+    """Create default config with no users.
+
+    Args:
+        api_port: Port of the glauth API.
+        tls: Whether to also serve LDAPS with the certificate from `load`.
+        bytecode_cache_dir: Optional directory to keep the compiled template in.
+
+    Returns:
+        bool: Whether the config file changed.
+    """
+    if tls and not (pathlib.Path(CERT_PATH).exists() and pathlib.Path(KEY_PATH).exists()):
+        logger.warning("no glauth certificate and key yet, not serving LDAPS")
+        tls = False
+
+    return render(
+        "glauth.toml.j2",
+        CONFIG_PATH,
+        bytecode_cache_dir,
+        api_port=api_port,
+        ldap_port=LDAP_PORT,
+        ldaps_port=LDAPS_PORT,
+        tls=tls,
+        cert=CERT_PATH,
+        key=KEY_PATH,
+    )
+
+
+def install(wait: bool = True) -> Optional[str]:
+    """Install glauth snap.
+
+    Args:
+        wait: Whether to block until snapd is done. If False, the install is only
+            submitted and its change ID returned, to be followed with `change_progress`.
+
+    Returns:
+        Optional[str]: The snapd change ID when not waiting.
+    """
+    try:
+        change = _snap().ensure(
+            snap.SnapState.Latest, channel=CHANNEL, backend=snapd.SnapBackend.API, wait=wait
+        )
+        if wait:
+            snapd.hold_refresh(backend=snapd.SnapBackend.API)
+        return change
     except snap.SnapError as e:
         logger.error("could not install glauth. Reason: %s", e.message)
         logger.debug(e, exc_info=True)
         raise e
+    finally:
+        invalidate()
 
 
 def installed() -> bool:
@@ -50,63 +245,269 @@ def installed() -> bool:
     return _snap().present
 
 
-def load() -> str:
+def _generate_key(key_type: str):
+    """Generate a private key of the given type."""
+    if key_type in ("rsa-2048", "rsa-3072", "rsa-4096"):
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[4:]))
+    if key_type == "ecdsa-p256":
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type == "ecdsa-p384":
+        return ec.generate_private_key(ec.SECP384R1())
+    if key_type == "ed25519":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"unsupported key type {key_type!r}, expected one of {KEY_TYPES}")
+
+
+def _write_atomic(path: pathlib.Path, data: bytes, mode: int) -> None:
+    """Replace the file at path with data, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def generate_certificate(key_type: str, common_name: str, days: int = 365) -> Tuple[bytes, bytes]:
+    """Generate a self-signed certificate.
+
+    Args:
+        key_type: One of KEY_TYPES.
+        common_name: Subject common name, also used as DNS subject alternative name.
+        days: Validity period.
+
+    Returns:
+        Tuple[bytes, bytes]: PEM encoded private key and certificate.
+    """
+    key = _generate_key(key_type)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        algorithm = None
+    elif key_type == "ecdsa-p384":
+        algorithm = hashes.SHA384()
+    else:
+        algorithm = hashes.SHA256()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, algorithm)
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM)
+
+
+def load(key_type: str = "rsa-4096", regenerate: bool = False) -> str:
     """Load ca-certificate from glauth snap.
 
+    Args:
+        key_type: Key type to generate if no certificate exists yet. One of KEY_TYPES.
+        regenerate: Replace an existing key and certificate with a new pair of key_type.
+
     Returns:
         str: The ca certificate content.
     """
-    cert = "/var/snap/glauth/common/etc/glauth/certs.d/glauth.crt"
-    key = "/var/snap/glauth/common/etc/glauth/keys.d/glauth.key"
-    if not pathlib.Path(cert).exists() and not pathlib.Path(key).exists():
+    cert = pathlib.Path(CERT_PATH)
+    key = pathlib.Path(KEY_PATH)
+    if regenerate or (not cert.exists() and not key.exists()):
         # If cert and key do not exist, create both
-        subprocess.call(
-            [
-                "openssl",
-                "req",
-                "-x509",
-                "-newkey",
-                "rsa:4096",
-                "-keyout",
-                f"{key}",
-                "-out",
-                f"{cert}",
-                "-days",
-                "365",
-                "-nodes",
-                "-subj",
-                f"/CN={socket.gethostname()}",
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
-    content = open(cert, "r").read()
-    return content
+        key_pem, cert_pem = generate_certificate(key_type, socket.gethostname())
+        _write_atomic(key, key_pem, 0o600)
+        _write_atomic(cert, cert_pem, 0o644)
+    return cert.read_text()
 
 
-def refresh() -> None:
+def refresh_skip_reason() -> Optional[str]:
+    """Check whether refreshing the glauth snap would change anything.
+
+    Returns:
+        Optional[str]: Why a refresh would be a no-op, or None if one is needed.
+    """
+    glauth = _snap()
+    if not glauth.present or _full_channel(glauth.channel) != CHANNEL:
+        return None
+    try:
+        latest = _store_revision(CHANNEL)
+    except snap.SnapAPIError as e:
+        # Without the store's view, refresh to be safe
+        logger.debug("could not look up glauth in the store: %s", e)
+        return None
+    if latest is None or latest != str(glauth.revision):
+        return None
+    return f"revision {glauth.revision} is already the latest in {CHANNEL}"
+
+
+def refresh(wait: bool = True) -> Optional[str]:
     """Refresh the glauth snap if there is a new revision."""
     # The operation here is exactly the same, so just call the install method
-    install()
+    return install(wait=wait)
 
 
 def remove() -> None:
     """Remove the glauth snap, preserving config and data."""
-    _snap().ensure(snap.SnapState.Absent)
+    try:
+        _snap().ensure(snap.SnapState.Absent, backend=snapd.SnapBackend.API)
+    finally:
+        invalidate()
 
 
 def start() -> None:
     """Start the glauth snap."""
-    _snap().start(enable=True)
+    try:
+        _snap().start(enable=True, backend=snapd.SnapBackend.API)
+    finally:
+        invalidate()
+
+
+def restart(reload: bool = False) -> None:
+    """Restart the glauth daemon, or only ask it to reload its config."""
+    try:
+        _snap().restart(["daemon"], reload=reload, backend=snapd.SnapBackend.API)
+    finally:
+        invalidate()
+
+
+def _listeners(content: str) -> Dict:
+    """Return the settings of a config file that need a restart to take effect."""
+    try:
+        config = toml.loads(content)
+    except toml.TomlDecodeError:
+        # Unknown layout, so any change may matter
+        return {"content": content}
+    return {
+        section: {key: value for key, value in settings.items() if key in RESTART_KEYS}
+        for section, settings in config.items()
+        if isinstance(settings, dict) and section in LISTENER_SECTIONS
+    }
+
+
+def config_state() -> Dict[str, str]:
+    """Fingerprint the effective glauth config.
+
+    Returns:
+        Dict[str, str]: SHA-256 digests of all of glauth.d ("config"), of the listener
+        settings in it ("listeners") and of the TLS key and certificate ("tls").
+    """
+    config, listeners, tls = hashlib.sha256(), hashlib.sha256(), hashlib.sha256()
+    config_dir = pathlib.Path(CONFIG_PATH).parent
+    files = sorted(config_dir.rglob("*")) if config_dir.is_dir() else []
+    for path in files:
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        content = path.read_bytes()
+        name = str(path.relative_to(config_dir)).encode()
+        config.update(name + b"\0" + content + b"\0")
+        listeners.update(
+            name + b"\0" + toml.dumps(_listeners(content.decode(errors="replace"))).encode()
+        )
+    for path in (pathlib.Path(CERT_PATH), pathlib.Path(KEY_PATH)):
+        tls.update(path.read_bytes() if path.exists() else b"")
+        tls.update(b"\0")
+    return {
+        "config": config.hexdigest(),
+        "listeners": listeners.hexdigest(),
+        "tls": tls.hexdigest(),
+    }
+
+
+def reconcile(applied: Optional[Dict[str, str]]) -> Tuple[str, Dict[str, str]]:
+    """Bring the glauth daemon in line with its config, disturbing it as little as possible.
+
+    Args:
+        applied: The `config_state` the running daemon was last (re)started with, if known.
+
+    Returns:
+        Tuple[str, Dict[str, str]]: What was done ("none", "reload", "restart" or "start")
+        and the config state now in effect.
+    """
+    state = config_state()
+    if not active():
+        start()
+        return "start", state
+    if state == applied:
+        return "none", state
+    if applied is None or any(applied.get(key) != state[key] for key in ("listeners", "tls")):
+        # Ports and TLS material are only read at startup
+        restart()
+        return "restart", state
+    restart(reload=True)
+    return "reload", state
+
+
+def wait_ready(tls: bool = False, timeout: float = READY_TIMEOUT) -> float:
+    """Wait for the glauth daemon to be active and to answer on the port clients are given.
+
+    Polls with exponential backoff, from 0.1 s up to 2 s between attempts.
+
+    Args:
+        tls: Whether clients are given the LDAPS port rather than the LDAP one.
+        timeout: Seconds to wait at most.
+
+    Returns:
+        float: Seconds it took.
+
+    Raises:
+        TimeoutError: If glauth is not ready in time.
+    """
+    port = LDAPS_PORT if tls else LDAP_PORT
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = 0.1
+    while True:
+        if not active():
+            reason = "daemon not active"
+        else:
+            try:
+                remaining = min(max(deadline - time.monotonic(), 0.1), 2.0)
+                probe.sample(LOCAL_HOST, port, tls=tls, timeout=remaining)
+                return time.monotonic() - start
+            except probe.ProbeError as e:
+                reason = str(e)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"glauth not ready after {timeout:g}s: {reason}")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 2.0)
+
+
+def revision() -> str:
+    """Return the installed GLAuth snap revision.
+
+    The current symlink is read first, which costs no snapd request.
+    """
+    try:
+        return os.readlink(CURRENT_PATH)
+    except OSError:
+        logger.debug("%s not readable, asking snapd", CURRENT_PATH)
+    glauth = _snap()
+    if glauth.present:
+        return str(glauth.revision)
+    raise snap.SnapError("glauth snap not installed, cannot fetch revision")
 
 
 def version() -> str:
     """Return GLAuth version."""
-    if _snap().present:
-        # Version separated by newlines includes version, build time and commit hash
-        # split by newlines, grab first line, grab second string for version
-        full_version = subprocess.run(
-            ["snap", "list", "glauth"], stdout=subprocess.PIPE, text=True
-        ).stdout.splitlines()[1]
-        return full_version.split()[2]
+    glauth = _snap()
+    if glauth.present:
+        # snapd reports the version published with the installed revision
+        if glauth.version is not None:
+            return glauth.version
+        return _snap_client().get_installed_snap_information("glauth")["version"]
     raise snap.SnapError("glauth snap not installed, cannot fetch version")
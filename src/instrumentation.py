@@ -0,0 +1,184 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Per-hook timing of event handlers, subprocesses and snapd requests.
+
+`install` wraps the subprocess helpers and the snapd client once per process, and
+`instrument` wraps event handlers of a charm or library class. Everything they record
+goes to the counters of the running hook, which `summary` returns and resets.
+"""
+
+import functools
+import math
+import os
+import subprocess
+import time
+from typing import Callable, Dict, List
+
+import snapd
+
+# Number of hooks kept for percentiles
+WINDOW = 100
+SUBPROCESS_FUNCTIONS = ("run", "call", "check_call", "check_output")
+
+
+class HookStats:
+    """Counters of the hook being run."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.handlers: Dict[str, float] = {}
+        self.commands: Dict[str, int] = {}
+        self.subprocess = {"calls": 0, "seconds": 0.0, "bytes": 0}
+        self.snapd = {"requests": 0, "seconds": 0.0, "bytes": 0}
+
+
+_stats = HookStats()
+# Nesting of subprocess helpers, so check_output calling run counts once
+_depth = 0
+
+
+def _output_size(result) -> int:
+    """Return the size of the output captured by a subprocess helper."""
+    if isinstance(result, subprocess.CompletedProcess):
+        result = result.stdout
+    return len(result) if isinstance(result, (bytes, str)) else 0
+
+
+def _wrap_subprocess(function: Callable) -> Callable:
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global _depth
+        if _depth:
+            return function(*args, **kwargs)
+        command = args[0] if args else kwargs.get("args", "")
+        if isinstance(command, (list, tuple)):
+            command = command[0] if command else ""
+        name = os.path.basename(str(command).split(" ", 1)[0])
+        _depth += 1
+        start = time.monotonic()
+        result = None
+        try:
+            result = function(*args, **kwargs)
+            return result
+        finally:
+            _depth -= 1
+            _stats.subprocess["calls"] += 1
+            _stats.subprocess["seconds"] += time.monotonic() - start
+            _stats.subprocess["bytes"] += _output_size(result)
+            _stats.commands[name] = _stats.commands.get(name, 0) + 1
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def _wrap_snapd(function: Callable) -> Callable:
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        result = b""
+        try:
+            result = function(*args, **kwargs)
+            return result
+        finally:
+            _stats.snapd["requests"] += 1
+            _stats.snapd["seconds"] += time.monotonic() - start
+            _stats.snapd["bytes"] += len(result or b"")
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def install() -> None:
+    """Record the subprocess calls and snapd requests made by this process.
+
+    The subprocess helpers are wrapped module-wide, so the hook tools run by ops are
+    counted along with the calls made by glauth and the snap library. snapd requests are
+    timed at `SnapClient._request_raw`, which every request goes through.
+    """
+    for name in SUBPROCESS_FUNCTIONS:
+        function = getattr(subprocess, name)
+        if not getattr(function, "instrumented", False):
+            setattr(subprocess, name, _wrap_subprocess(function))
+    if not getattr(snapd.SnapClient._request_raw, "instrumented", False):
+        snapd.SnapClient._request_raw = _wrap_snapd(snapd.SnapClient._request_raw)
+
+
+def _wrap_handler(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def wrapper(self, event):
+        start = time.monotonic()
+        try:
+            return method(self, event)
+        finally:
+            key = f"{type(self).__name__}.{method.__name__}"
+            _stats.handlers[key] = _stats.handlers.get(key, 0.0) + time.monotonic() - start
+
+    return wrapper
+
+
+def instrument(*names: str) -> Callable[[type], type]:
+    """Return a class decorator timing the named event handlers.
+
+    The handlers are replaced on the class under their own name, which ops relies on to
+    re-emit deferred events.
+    """
+
+    def decorator(cls: type) -> type:
+        for name in names:
+            setattr(cls, name, _wrap_handler(getattr(cls, name)))
+        return cls
+
+    return decorator
+
+
+def event_name() -> str:
+    """Return the name of the hook or action being dispatched."""
+    return os.path.basename(os.environ.get("JUJU_DISPATCH_PATH", "")) or "unknown"
+
+
+def summary() -> Dict:
+    """Return what was recorded since the previous summary, and start over."""
+    global _stats
+    stats, _stats = _stats, HookStats()
+    return {
+        "event": event_name(),
+        "seconds": round(time.monotonic() - stats.start, 6),
+        "handlers": {name: round(seconds, 6) for name, seconds in stats.handlers.items()},
+        "commands": stats.commands,
+        "subprocess": {**stats.subprocess, "seconds": round(stats.subprocess["seconds"], 6)},
+        "snapd": {**stats.snapd, "seconds": round(stats.snapd["seconds"], 6)},
+    }
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def percentiles(records: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """Summarize hook summaries by event.
+
+    Returns:
+        Dict[str, Dict[str, str]]: For each event, the number of hooks, the p50, p90, p99
+        and max hook duration in seconds, and the p50 of subprocess calls and snapd
+        requests.
+    """
+    by_event: Dict[str, List[Dict]] = {}
+    for record in records:
+        by_event.setdefault(record["event"], []).append(record)
+    result = {}
+    for event, hooks in sorted(by_event.items()):
+        seconds = sorted(hook["seconds"] for hook in hooks)
+        calls = sorted(hook["subprocess"]["calls"] for hook in hooks)
+        requests = sorted(hook["snapd"]["requests"] for hook in hooks)
+        result[event] = {
+            "count": str(len(hooks)),
+            "p50": f"{_percentile(seconds, 50):.3f}",
+            "p90": f"{_percentile(seconds, 90):.3f}",
+            "p99": f"{_percentile(seconds, 99):.3f}",
+            "max": f"{seconds[-1]:.3f}",
+            "subprocess-p50": str(_percentile(calls, 50)),
+            "snapd-p50": str(_percentile(requests, 50)),
+        }
+    return result
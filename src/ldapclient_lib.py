@@ -24,10 +24,16 @@ This library contains the Provides and Requires classes for handling the ldap-cl
 
 """
 
+import hashlib
+import json
 import logging
+import os
 import pathlib
 import socket
+import tempfile
+import weakref
 import zipfile
+from typing import Dict, List, NamedTuple, Optional, Union
 
 from ops.charm import (
     CharmBase,
@@ -35,40 +41,250 @@ from ops.charm import (
     RelationBrokenEvent,
     RelationChangedEvent,
     RelationJoinedEvent,
+    SecretChangedEvent,
+)
+from ops.framework import EventBase, EventSource, Framework, Handle, Object, StoredState
+from ops.model import (
+    ActiveStatus,
+    BlockedStatus,
+    MaintenanceStatus,
+    ModelError,
+    Relation,
+    SecretNotFoundError,
 )
-from ops.framework import EventBase, EventSource, Handle, Object
-from ops.model import ActiveStatus, MaintenanceStatus, ModelError
 
 logger = logging.getLogger(__name__)
 
+LDAP_PORT = 363
+LDAPS_PORT = 636
+
+CONFIG_DIR = "/var/snap/glauth/common/etc/glauth/glauth.d/"
+CONFIG_MANIFEST = "/var/snap/glauth/common/etc/glauth/config-manifest.json"
+CERT_PATH = "/var/snap/glauth/common/etc/glauth/certs.d/glauth.crt"
+# Upper bound on the uncompressed size of the config resource
+MAX_CONFIG_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Fields shared with requirers; older providers keep each in a secret of its own
+SECRET_KEYS = ("ca-cert", "ldap-default-bind-dn", "ldap-password")
+# Label of the secret bundling all fields, and the relation key holding its ID
+CREDENTIALS_LABEL = "ldap-credentials"
+CREDENTIALS_SCHEMA = "1"
+
+
+class ConfigResourceError(Exception):
+    """Raised when the config resource cannot be safely extracted."""
+
+
+class ConfigChanges(NamedTuple):
+    """Files touched by extracting the config resource, relative to the config directory."""
+
+    added: List[str]
+    modified: List[str]
+    removed: List[str]
+
+    @property
+    def changed(self) -> bool:
+        """Return whether any file was added, modified or removed."""
+        return bool(self.added or self.modified or self.removed)
+
+
+def _extract_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo, target: pathlib.Path):
+    """Stream one archive member to target through a temporary file."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+    try:
+        written = 0
+        with os.fdopen(fd, "wb") as out, archive.open(member) as src:
+            while chunk := src.read(CHUNK_SIZE):
+                written += len(chunk)
+                if written > member.file_size:
+                    raise ConfigResourceError(f"{member.filename} is larger than declared")
+                out.write(chunk)
+        os.replace(tmp, target)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def extract_config(
+    archive: Union[str, pathlib.Path],
+    dest: str = CONFIG_DIR,
+    manifest: str = CONFIG_MANIFEST,
+    max_size: int = MAX_CONFIG_SIZE,
+) -> ConfigChanges:
+    """Extract only what changed in the config archive since the previous extraction.
+
+    Members are compared by CRC32 and size against the manifest written by the previous run.
+    Changed members are streamed to temporary files and renamed into place, and files from the
+    previous archive that are gone from this one are removed.
+
+    Args:
+        archive: Path to the zip archive.
+        dest: Directory to extract into.
+        manifest: Path of the manifest recording the previous extraction.
+        max_size: Maximum total uncompressed size of the archive.
+
+    Returns:
+        ConfigChanges: The files that were added, modified or removed.
+
+    Raises:
+        ConfigResourceError: If the archive is invalid, too large, or escapes dest.
+    """
+    dest = pathlib.Path(dest).resolve()
+    manifest = pathlib.Path(manifest)
+    try:
+        previous = json.loads(manifest.read_text())
+    except (FileNotFoundError, ValueError):
+        previous = {}
+
+    changes = ConfigChanges([], [], [])
+    current = {}
+    try:
+        with zipfile.ZipFile(archive, "r") as zip:
+            members = [member for member in zip.infolist() if not member.is_dir()]
+            total = sum(member.file_size for member in members)
+            if total > max_size:
+                raise ConfigResourceError(
+                    f"config resource expands to {total} bytes, more than {max_size}"
+                )
+            for member in members:
+                target = dest.joinpath(member.filename).resolve()
+                if dest not in target.parents:
+                    raise ConfigResourceError(f"{member.filename} is outside of {dest}")
+                entry = {"crc": member.CRC, "size": member.file_size}
+                current[member.filename] = entry
+                if previous.get(member.filename) == entry and target.exists():
+                    continue
+                _extract_member(zip, member, target)
+                if member.filename in previous:
+                    changes.modified.append(member.filename)
+                else:
+                    changes.added.append(member.filename)
+    except zipfile.BadZipFile as e:
+        raise ConfigResourceError(f"invalid config resource: {e}")
+
+    for name in previous:
+        if name not in current:
+            dest.joinpath(name).unlink(missing_ok=True)
+            changes.removed.append(name)
+
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest.with_name(f".{manifest.name}.tmp")
+    tmp.write_text(json.dumps(current))
+    os.replace(tmp, manifest)
+    logger.debug(
+        "config resource: %d added, %d modified, %d removed",
+        len(changes.added),
+        len(changes.modified),
+        len(changes.removed),
+    )
+    return changes
+
+
+def _certificate_fingerprint() -> Optional[str]:
+    """Return the SHA-256 of the GLAuth certificate, or None if there is none yet."""
+    try:
+        return hashlib.sha256(pathlib.Path(CERT_PATH).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def credentials_content(ca_cert: str, default_bind_dn: str, password: str) -> Dict[str, str]:
+    """Return the content of the ldap-credentials secret.
+
+    Args:
+        ca_cert: CA certificate of the LDAP server.
+        default_bind_dn: DN requirers bind as.
+        password: Password of the default bind DN.
+
+    Returns:
+        dict: Secret content, tagged with the schema version.
+    """
+    return {
+        "schema-version": CREDENTIALS_SCHEMA,
+        "ca-cert": ca_cert,
+        "ldap-default-bind-dn": default_bind_dn,
+        "ldap-password": password,
+    }
+
+
+def _unique_id(secret_id: str) -> str:
+    """Return the secret ID without the secret: prefix and model UUID."""
+    return secret_id.rsplit("/", 1)[-1].split(":", 1)[-1]
+
+
+# Secret content read during the current dispatch, keyed by unique secret ID. Events are
+# rebuilt from their snapshots before observers see them, so the content cannot ride on the
+# event; it is kept per framework instead, in memory only.
+_secret_contents: "weakref.WeakKeyDictionary[Framework, Dict[str, Dict[str, str]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _secret_cache(framework: Framework) -> Dict[str, Dict[str, str]]:
+    """Return the secret content read so far by this framework, keyed by unique ID."""
+    return _secret_contents.setdefault(framework, {})
+
+
+class _SecretContentEvent(EventBase):
+    """Base for events carrying secret content, snapshotted as secret IDs only.
+
+    Content is read from the secret, at the revision the unit tracks, on first access in
+    the hook; the requirer shares what it already read.
+    """
 
-class CertificateAvailableEvent(EventBase):
+    def __init__(self, handle: Handle):
+        super().__init__(handle)
+        # Content snapshotted by older releases, keyed by placeholder secret ID
+        self._contents: Dict[str, Dict[str, str]] = {}
+
+    def _field(self, secret_id: str, key: str) -> str:
+        """Return a field of the secret content, reading the secret at most once per hook."""
+        if secret_id in self._contents:
+            return self._contents[secret_id][key]
+        cache = _secret_cache(self.framework)
+        if _unique_id(secret_id) not in cache:
+            secret = self.framework.model.get_secret(id=secret_id)
+            cache[_unique_id(secret_id)] = secret.get_content()
+        return cache[_unique_id(secret_id)][key]
+
+
+class CertificateAvailableEvent(_SecretContentEvent):
     """Charm Event triggered when a CA certificate is available."""
 
     def __init__(
         self,
         handle: Handle,
-        ca_cert: str,
+        ca_cert_secret: str,
     ):
         super().__init__(handle)
-        self.ca_cert = ca_cert
+        self.ca_cert_secret = ca_cert_secret
+
+    @property
+    def ca_cert(self) -> str:
+        """Return the CA certificate."""
+        return self._field(self.ca_cert_secret, "ca-cert")
 
     def snapshot(self) -> dict:
         """Return snapshot."""
         return {
-            "ca_cert": self.ca_cert,
+            "ca_cert_secret": self.ca_cert_secret,
         }
 
     def restore(self, snapshot: dict):
         """Restore snapshot."""
-        self.ca_cert = snapshot["ca_cert"]
+        self._contents = {}
+        # Deferred by a release that stored the content itself, under a placeholder ID
+        self.ca_cert_secret = snapshot.get("ca_cert_secret", "ca_cert")
+        if "ca_cert" in snapshot:
+            self._contents[self.ca_cert_secret] = {"ca-cert": snapshot["ca_cert"]}
 
 
 class CertificateUnavailableEvent(EventBase):
     """Charm Event triggered when a CA certificate is unavailable."""
 
 
-class ConfigDataAvailableEvent(EventBase):
+class ConfigDataAvailableEvent(_SecretContentEvent):
     """Charm Event triggered when config data is available."""
 
     def __init__(
@@ -76,30 +292,45 @@ class ConfigDataAvailableEvent(EventBase):
         handle: Handle,
         basedn: str,
         ldap_uri: str,
-        ldbd_content: str,
-        lp_content: str,
+        ldbd_secret: str,
+        lp_secret: str,
     ):
         super().__init__(handle)
         self.basedn = basedn
         self.ldap_uri = ldap_uri
-        self.ldbd_content = ldbd_content
-        self.lp_content = lp_content
+        self.ldbd_secret = ldbd_secret
+        self.lp_secret = lp_secret
+
+    @property
+    def ldbd_content(self) -> str:
+        """Return the default bind DN."""
+        return self._field(self.ldbd_secret, "ldap-default-bind-dn")
+
+    @property
+    def lp_content(self) -> str:
+        """Return the password of the default bind DN."""
+        return self._field(self.lp_secret, "ldap-password")
 
     def snapshot(self) -> dict:
         """Return snapshot."""
         return {
             "basedn": self.basedn,
             "ldap_uri": self.ldap_uri,
-            "ldbd_content": self.ldbd_content,
-            "lp_content": self.lp_content,
+            "ldbd_secret": self.ldbd_secret,
+            "lp_secret": self.lp_secret,
         }
 
     def restore(self, snapshot: dict):
         """Restore snapshot."""
+        self._contents = {}
         self.basedn = snapshot["basedn"]
         self.ldap_uri = snapshot["ldap_uri"]
-        self.ldbd_content = snapshot["ldbd_content"]
-        self.lp_content = snapshot["lp_content"]
+        # Deferred by a release that stored the content itself, under placeholder IDs
+        self.ldbd_secret = snapshot.get("ldbd_secret", "ldbd_content")
+        self.lp_secret = snapshot.get("lp_secret", "lp_content")
+        if "ldbd_content" in snapshot:
+            self._contents[self.ldbd_secret] = {"ldap-default-bind-dn": snapshot["ldbd_content"]}
+            self._contents[self.lp_secret] = {"ldap-password": snapshot["lp_content"]}
 
 
 class ConfigDataUnavailableEvent(EventBase):
@@ -155,9 +386,19 @@ class LdapClientProvides(Object):
     """Provides-side of the ldapclient integration."""
 
     on = LdapClientProviderCharmEvents()
+    _stored = StoredState()
 
     def __init__(self, charm: CharmBase, integration_name: str) -> None:
         super().__init__(charm, integration_name)
+        self._stored.set_default(
+            applied_config=None,
+            resource_stat=None,
+            resource_hits=0,
+            resource_misses=0,
+            granted={},
+            published={},
+            server_ready=True,
+        )
         self.framework.observe(
             charm.on[integration_name].relation_broken,
             self._on_relation_broken,
@@ -168,75 +409,190 @@ class LdapClientProvides(Object):
         )
         self.charm = charm
         self.integration_name = integration_name
+        self.config_changes: Optional[ConfigChanges] = None
+        self._reconciling = False
 
     def _on_relation_broken(self, event: RelationBrokenEvent) -> None:
         """Handle relation-broken event.
 
-        When the ldapclient relation is broken and emits:
+        The secrets stay shared with the other relations; only the grants of the broken
+        relation are revoked. Emits:
         - Server unavailable event: When the ldap server can't be reached.
         """
-        # Remove Obsolete Secrets
-        ca_cert_secret = self.model.get_secret(label="ca-cert")
-        ldbd_secret = self.model.get_secret(label="ldap-default-bind-dn")
-        lp_secret = self.model.get_secret(label="ldap-password")
-        ca_cert_secret.remove_all_revisions()
-        ldbd_secret.remove_all_revisions()
-        lp_secret.remove_all_revisions()
+        key = str(event.relation.id)
+        if self.charm.unit.is_leader():
+            for secret_id in self._stored.granted.get(key, []):
+                try:
+                    self.model.get_secret(id=secret_id).revoke(event.relation)
+                except SecretNotFoundError:
+                    continue
+        self._stored.granted.pop(key, None)
+        self._stored.published.pop(key, None)
         self.on.server_unavailable.emit()
 
     def _on_relation_joined(self, event: RelationJoinedEvent) -> None:
         """Event emitted when the relation is joined.
 
-        Looks at the relation data and config values and emits:
+        Publishes to the joined relation, see `reconcile`.
+        """
+        self.reconcile()
+
+    def reconcile(self) -> None:
+        """Bring GLAuth and every ldap-client relation in line with the config and resources.
+
+        The desired state (config resource and certificate fingerprints, LDAP URI, secret
+        grants, relation data) is computed once and compared with what was last applied, as
+        kept in stored state. Only the difference is applied: a burst of joining units
+        reconfigures GLAuth once, and relations that are already current are skipped. A new
+        certificate, or the first one, reconfigures GLAuth so it serves it. Emits:
         - config unavailable event: If the config resource is not supplied.
-        - ldap ready event: When the necessary ldap components are available.
+        - ldap ready event: When the config changed and GLAuth should pick it up.
         """
-        self.charm.unit.status = MaintenanceStatus("reconfiguring ldap")
+        relations = self.model.relations[self.integration_name]
+        if not relations:
+            logger.debug("no %s relations to reconcile", self.integration_name)
+            return
 
         # Check model for GLAuth config resource
         try:
             resource_path = self.model.resources.fetch("config")
         except ModelError:
             logger.debug("No config resource supplied")
-            self.on.config_data_unavailable.emit(api_port=self.model.config["api-port"])
             resource_path = None
 
+        # Skip reconfiguring if the same resource, settings and certificate were already applied
+        tls = self.model.config["tls"]
+        fingerprint = self._fingerprint(resource_path) if resource_path else None
+        certificate = _certificate_fingerprint()
+        applied_config = f"{tls}:{self.model.config['api-port']}:{fingerprint}:{certificate}"
+        reconfigure = applied_config != self._stored.applied_config
+        if reconfigure:
+            self._stored.resource_misses += 1
+            self.charm.unit.status = MaintenanceStatus("reconfiguring ldap")
+        else:
+            self._stored.resource_hits += 1
+            logger.debug("config resource %s already applied", fingerprint)
+
+        if reconfigure and resource_path is None:
+            self.on.config_data_unavailable.emit(api_port=self.model.config["api-port"])
+
         # Set config and get LDAP URI
-        ldap_uri = self.set_config(self.model.config["tls"], config=resource_path)
+        try:
+            ldap_uri = self.set_config(tls, config=resource_path if reconfigure else None)
+        except ConfigResourceError as e:
+            logger.error("could not apply config resource: %s", e)
+            self.charm.unit.status = BlockedStatus(f"invalid config resource: {e}")
+            return
+
+        # Signals ldap is ready to be (re)started
+        if reconfigure:
+            self._reconciling = True
+            try:
+                self.on.ldap_ready.emit()
+            finally:
+                self._reconciling = False
+            self._stored.applied_config = applied_config
+
+        # Clients connect as soon as they see the URI
+        if self._stored.server_ready:
+            self._publish(relations, ldap_uri)
+        else:
+            logger.info("LDAP server not ready, not publishing relation data yet")
+
+        # Unless an ldap-ready observer already reported on the outcome
+        if reconfigure and self.charm.unit.status == MaintenanceStatus("reconfiguring ldap"):
+            self.charm.unit.status = ActiveStatus()
+
+    def set_server_ready(self, ready: bool) -> None:
+        """Record whether the LDAP server accepts connections.
 
+        Relation data is only published while it does. Once the server becomes ready
+        outside of a reconciliation, the relations are brought up to date.
+
+        Args:
+            ready: Whether the server accepts connections.
+        """
+        was_ready = self._stored.server_ready
+        self._stored.server_ready = ready
+        if ready and not was_ready and not self._reconciling:
+            self.reconcile()
+
+    def _publish(self, relations: List[Relation], ldap_uri: str) -> None:
+        """Grant the secrets and write the relation data, for relations not yet current.
+
+        Only the leader owns the secrets and the application databag.
+        """
+        if not self.charm.unit.is_leader():
+            logger.debug("not leader, leaving relation data to the leader")
+            return
         # Get App Peer Secrets
-        ldap_relation = self.model.get_relation(self.charm.app.name)
-        ca_cert = ldap_relation.data[self.charm.app]["ca-cert"]
-        default_bind_dn = ldap_relation.data[self.charm.app]["ldap-default-bind-dn"]
-        ldap_password = ldap_relation.data[self.charm.app]["ldap-password"]
-        cc_secret = self.model.get_secret(id=ca_cert)
-        ldbd_secret = self.model.get_secret(id=default_bind_dn)
-        lp_secret = self.model.get_secret(id=ldap_password)
-
-        # Signals ldap is ready to be started
-        self.on.ldap_ready.emit()
-
-        # Create Secrets
-        cc_secret.grant(event.relation)
-        ldbd_secret.grant(event.relation)
-        lp_secret.grant(event.relation)
-        event.relation.data[self.charm.app]["ca-cert"] = cc_secret.id
-        event.relation.data[self.charm.app]["ldap-default-bind-dn"] = ldbd_secret.id
-        event.relation.data[self.charm.app]["ldap-password"] = lp_secret.id
-
-        # Configuration data update
-        ldap_relation = self.model.get_relation("ldap-client")
-        ldap_relation.data[self.charm.app].update(
-            {
-                "basedn": self.model.config["ldap-search-base"],
-                "ldap-uri": ldap_uri,
+        secret_ids = self._secret_ids()
+        data = {
+            **secret_ids,
+            "basedn": self.model.config["ldap-search-base"],
+            "ldap-uri": ldap_uri,
+        }
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        granted = sorted(secret_id for secret_id in secret_ids.values() if secret_id)
+
+        updated = 0
+        for relation in relations:
+            key = str(relation.id)
+            if self._stored.published.get(key) == digest:
+                continue
+            if list(self._stored.granted.get(key, [])) != granted:
+                for secret_id in granted:
+                    self.model.get_secret(id=secret_id).grant(relation)
+                self._stored.granted[key] = granted
+            relation.data[self.charm.app].update(data)
+            self._stored.published[key] = digest
+            updated += 1
+        logger.debug("published to %d of %d relations", updated, len(relations))
+
+    def _secret_ids(self) -> dict:
+        """Return the IDs of the secrets shared with requirers, as stored in the peer relation.
+
+        The ldap-credentials secret is preferred; the per-field secrets of older releases are
+        shared until it exists, and cleared from the relation once it does.
+        """
+        peer_relation = self.model.get_relation(self.charm.app.name)
+        if peer_relation is None:
+            return {}
+        databag = peer_relation.data[self.charm.app]
+        if databag.get(CREDENTIALS_LABEL):
+            return {
+                CREDENTIALS_LABEL: databag[CREDENTIALS_LABEL],
+                **dict.fromkeys(SECRET_KEYS, ""),
             }
-        )
-        self.charm.unit.status = ActiveStatus()
+        return {key: databag[key] for key in SECRET_KEYS if key in databag}
+
+    @property
+    def resource_cache_stats(self) -> dict:
+        """Return how often joining units found the config resource already applied."""
+        return {"hits": self._stored.resource_hits, "misses": self._stored.resource_misses}
+
+    def _fingerprint(self, path: pathlib.Path) -> str:
+        """Return the size and SHA-256 of the resource, rehashing only if the file changed."""
+        stat = os.stat(path)
+        key = {"path": str(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        cached = self._stored.resource_stat
+        if cached is not None and all(cached.get(k) == v for k, v in key.items()):
+            return cached["fingerprint"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        fingerprint = f"{stat.st_size}:{digest.hexdigest()}"
+        self._stored.resource_stat = {**key, "fingerprint": fingerprint}
+        return fingerprint
 
     def set_config(self, tls: bool, config: pathlib.Path) -> str:
         """Set GLAuth config resource. Create default if none found.
 
+        Only the files that changed since the previous call are extracted; the change set is
+        kept in `config_changes`.
+
         Args:
             tls: TLS check.
             config: Resource config Path object.
@@ -244,14 +600,17 @@ class LdapClientProvides(Object):
 
         Returns:
             str: LDAP URI.
+
+        Raises:
+            ConfigResourceError: If the config resource cannot be safely extracted.
         """
+        self.config_changes = None
         if config:
-            with zipfile.ZipFile(config, "r") as zip:
-                zip.extractall("/var/snap/glauth/common/etc/glauth/glauth.d/")
+            self.config_changes = extract_config(config)
         if tls:
-            ldap_uri = f"ldaps://{socket.gethostname()}:636"
+            ldap_uri = f"ldaps://{socket.gethostname()}:{LDAPS_PORT}"
         else:
-            ldap_uri = f"ldap://{socket.gethostname()}:363"
+            ldap_uri = f"ldap://{socket.gethostname()}:{LDAP_PORT}"
         return ldap_uri
 
 
@@ -259,9 +618,13 @@ class LdapClientRequires(Object):
     """Requires-side of the ldapclient integration."""
 
     on = LdapClientRequirerCharmEvents()
+    _stored = StoredState()
 
     def __init__(self, charm: CharmBase, integration_name: str) -> None:
         super().__init__(charm, integration_name)
+        # Digest of the relation data and secret IDs last emitted per relation. Secret
+        # contents are only kept in memory, so no credential is derivable from stored state.
+        self._stored.set_default(emitted={})
         self.framework.observe(
             charm.on[integration_name].relation_changed,
             self._on_relation_changed,
@@ -270,6 +633,7 @@ class LdapClientRequires(Object):
             charm.on[integration_name].relation_broken,
             self._on_relation_broken,
         )
+        self.framework.observe(charm.on.secret_changed, self._on_secret_changed)
         self.charm = charm
         self.integration_name = integration_name
 
@@ -279,6 +643,7 @@ class LdapClientRequires(Object):
         When the ldapclient relation is broken and emits:
         - Server unavailable event: When the ldap server can't be reached.
         """
+        self._stored.emitted.pop(str(event.relation.id), None)
         self.on.server_unavailable.emit()
 
     def _on_relation_changed(self, event: RelationChangedEvent):
@@ -290,35 +655,129 @@ class LdapClientRequires(Object):
         - Configuration data available event: When configuration data is available.
         - Configuration data unavailable event: When configuration data is unavailable.
         - Ldap ready event: When cert and config are available.
+
+        Nothing is emitted if the data is the same as last emitted for the relation. The
+        tracked secret revisions only move on secret-changed, so their contents are too.
+        """
+        self._emit_config(event.relation)
+
+    def _on_secret_changed(self, event: SecretChangedEvent):
+        """Handle secret-changed event.
+
+        When the provider rotates the credentials of a relation, tracks the new revision
+        and emits the same events as relation-changed.
+        """
+        refreshed = False
+        for relation in self.model.relations[self.integration_name]:
+            if relation.app is None:
+                continue
+            secret_ids = self._secret_ids(relation.data[relation.app])
+            if _unique_id(event.secret.id) not in map(_unique_id, secret_ids):
+                continue
+            if not refreshed:
+                self._track(event.secret.id, event.secret.get_content(refresh=True))
+                refreshed = True
+            self._emit_config(relation, rotated=True)
+
+    def _emitted(self, relation: Relation) -> Optional[str]:
+        """Return the digest of the payload last emitted for the relation."""
+        return self._stored.emitted.get(str(relation.id))
+
+    def _emit_config(self, relation: Relation, rotated: bool = False):
+        """Emit the certificate and config data events, if the payload changed.
+
+        Args:
+            relation: The ldap-client relation.
+            rotated: Whether the unit just refreshed a secret of the relation to a new revision.
         """
+        databag = relation.data[relation.app]
+        digest = self._payload_digest(databag)
+        if digest == self._emitted(relation) and not rotated:
+            logger.debug("ldap-client relation data unchanged")
+            return
+        self._stored.emitted[str(relation.id)] = digest
         # SSSD Observer retrieves secrets
-        ca_cert = event.relation.data[event.app]["ca-cert"]
-        default_bind_dn = event.relation.data[event.app]["ldap-default-bind-dn"]
-        ldap_password = event.relation.data[event.app]["ldap-password"]
-        cc_secret = self.model.get_secret(id=ca_cert)
-        ldbd_secret = self.model.get_secret(id=default_bind_dn)
-        lp_secret = self.model.get_secret(id=ldap_password)
-        cc_content = cc_secret.get_content()
-        ldbd_content = ldbd_secret.get_content()
-        lp_content = lp_secret.get_content()
-        if None not in [cc_content["ca-cert"]]:
-            self.on.certificate_available.emit(ca_cert=cc_content["ca-cert"])
+        credentials = self._credentials(databag)
+        field_secrets = self._field_secrets(databag)
+
+        if credentials.get("ca-cert") is not None:
+            self.on.certificate_available.emit(ca_cert_secret=field_secrets["ca-cert"])
         # SSSD Configuration relation data
-        auth_relation = self.model.get_relation("ldap-client")
-        basedn = auth_relation.data[event.app].get("basedn")
-        ldap_uri = auth_relation.data[event.app].get("ldap-uri")
+        basedn = databag.get("basedn")
+        ldap_uri = databag.get("ldap-uri")
         if None not in [
-            ldbd_content["ldap-default-bind-dn"],
-            lp_content["ldap-password"],
+            credentials.get("ldap-default-bind-dn"),
+            credentials.get("ldap-password"),
             basedn,
             ldap_uri,
         ]:
             self.on.config_data_available.emit(
                 basedn=basedn,
                 ldap_uri=ldap_uri,
-                ldbd_content=ldbd_content["ldap-default-bind-dn"],
-                lp_content=lp_content["ldap-password"],
+                ldbd_secret=field_secrets["ldap-default-bind-dn"],
+                lp_secret=field_secrets["ldap-password"],
             )
             self.on.ldap_ready.emit()
         else:
             logger.error("sssd-ldap relation-changed data not found: ca-cert and sssd-conf.")
+
+    def _payload_digest(self, databag) -> str:
+        """Return a digest of the relation data and the IDs of its secrets."""
+        payload = {
+            "basedn": databag.get("basedn"),
+            "ldap-uri": databag.get("ldap-uri"),
+            "secrets": [_unique_id(secret_id) for secret_id in self._secret_ids(databag)],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def _field_secrets(databag) -> Dict[str, str]:
+        """Return the ID of the secret holding each shared field, in either layout."""
+        if databag.get(CREDENTIALS_LABEL):
+            return dict.fromkeys(SECRET_KEYS, databag[CREDENTIALS_LABEL])
+        return {key: databag[key] for key in SECRET_KEYS if databag.get(key)}
+
+    def _secret_ids(self, databag) -> List[str]:
+        """Return the IDs of the secrets the provider shares, in either layout."""
+        return sorted(set(self._field_secrets(databag).values()))
+
+    def _secret_content(self, secret_id: str) -> Dict[str, str]:
+        """Return the content of the tracked secret revision, fetched once per hook."""
+        key = _unique_id(secret_id)
+        if key not in _secret_cache(self.framework):
+            self._track(secret_id, self.model.get_secret(id=secret_id).get_content())
+        return _secret_cache(self.framework)[key]
+
+    def _track(self, secret_id: str, content: Dict[str, str]) -> None:
+        """Remember the content of the tracked revision for the rest of the hook.
+
+        The events emitted in the hook read from the same cache.
+        """
+        _secret_cache(self.framework)[_unique_id(secret_id)] = content
+
+    def _credentials(self, databag) -> Dict[str, str]:
+        """Read the fields shared by the provider, from either secret layout.
+
+        Args:
+            databag: Provider application relation data.
+
+        Returns:
+            dict: The ca-cert, ldap-default-bind-dn and ldap-password fields found.
+        """
+        secret_id = databag.get(CREDENTIALS_LABEL)
+        if secret_id:
+            content = self._secret_content(secret_id)
+            if content.get("schema-version") != CREDENTIALS_SCHEMA:
+                logger.warning(
+                    "ldap-credentials schema %s, expected %s",
+                    content.get("schema-version"),
+                    CREDENTIALS_SCHEMA,
+                )
+            return {key: content[key] for key in SECRET_KEYS if key in content}
+
+        # Providers predating ldap-credentials share one secret per field
+        credentials = {}
+        for key in SECRET_KEYS:
+            if databag.get(key):
+                credentials[key] = self._secret_content(databag[key])[key]
+        return credentials
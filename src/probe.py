@@ -0,0 +1,239 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Liveness and latency probe for the GLAuth LDAP listeners.
+
+A probe opens a TCP connection, completes the TLS handshake on LDAPS ports, and runs an
+anonymous base search of the root DSE. The LDAP messages are BER-encoded here, so no LDAP
+client library is needed.
+"""
+
+import errno
+import select
+import socket
+import ssl
+import statistics
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+SAMPLES = 3
+TIMEOUT = 2.0
+
+# LDAPMessage, and the protocolOp tags of the messages sent and expected
+SEQUENCE = 0x30
+SEARCH_REQUEST = 0x63
+SEARCH_RESULT_ENTRY = 0x64
+SEARCH_RESULT_DONE = 0x65
+UNBIND_REQUEST = 0x42
+
+
+class ProbeError(Exception):
+    """Raised when the LDAP server refuses the connection or answers nonsense."""
+
+
+class ProbeUnreachableError(ProbeError):
+    """Raised when nothing answers on the LDAP port."""
+
+
+class ProbeTimeoutError(ProbeUnreachableError):
+    """Raised when the LDAP server does not answer in time."""
+
+
+class ProbeResult(NamedTuple):
+    """Duration in seconds of each step ("connect", "tls", "search") of each sample."""
+
+    samples: List[Dict[str, float]]
+
+    @property
+    def totals(self) -> List[float]:
+        """Return the total duration of each sample."""
+        return [sum(sample.values()) for sample in self.samples]
+
+    @property
+    def p50(self) -> float:
+        """Return the median total duration."""
+        return statistics.median(self.totals)
+
+    @property
+    def max(self) -> float:
+        """Return the longest total duration."""
+        return max(self.totals)
+
+
+def _tlv(tag: int, value: bytes) -> bytes:
+    """BER-encode a tag, length and value."""
+    if len(value) < 0x80:
+        return bytes([tag, len(value)]) + value
+    length = len(value).to_bytes((len(value).bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(length)]) + length + value
+
+
+def _message(message_id: int, protocol_op: bytes) -> bytes:
+    """Wrap a protocolOp into an LDAPMessage."""
+    return _tlv(SEQUENCE, _tlv(0x02, bytes([message_id])) + protocol_op)
+
+
+# Base search of "" for (objectClass=*), as any client discovering the server would send
+ROOT_DSE_REQUEST = _message(
+    1,
+    _tlv(
+        SEARCH_REQUEST,
+        _tlv(0x04, b"")  # baseObject
+        + _tlv(0x0A, b"\x00")  # scope: baseObject
+        + _tlv(0x0A, b"\x00")  # derefAliases: never
+        + _tlv(0x02, b"\x00")  # sizeLimit
+        + _tlv(0x02, b"\x00")  # timeLimit
+        + _tlv(0x01, b"\x00")  # typesOnly: false
+        + _tlv(0x87, b"objectClass")  # filter: present
+        + _tlv(SEQUENCE, b""),  # attributes: all user attributes
+    ),
+)
+UNBIND = _message(2, _tlv(UNBIND_REQUEST, b""))
+
+
+def _read_tlv(data: bytes, offset: int) -> Tuple[int, bytes, int]:
+    """Decode the BER element at offset.
+
+    Returns:
+        Tuple[int, bytes, int]: The tag, the value, and the offset after the element.
+
+    Raises:
+        IndexError: If data ends before the element does.
+    """
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        if size == 0 or offset + size > len(data):
+            raise IndexError("incomplete length")
+        length = int.from_bytes(data[offset : offset + size], "big")
+        offset += size
+    if offset + length > len(data):
+        raise IndexError("incomplete value")
+    return tag, data[offset : offset + length], offset + length
+
+
+def _search_done(data: bytes) -> int:
+    """Return the result code once data holds the SearchResultDone, or -1 until then.
+
+    Raises:
+        ProbeError: If data is not a stream of search responses.
+    """
+    offset = 0
+    while offset < len(data):
+        try:
+            tag, message, offset = _read_tlv(data, offset)
+            _, _, op_offset = _read_tlv(message, 0)  # messageID
+            op_tag, op, _ = _read_tlv(message, op_offset)
+        except IndexError:
+            return -1
+        if tag != SEQUENCE or op_tag not in (SEARCH_RESULT_ENTRY, SEARCH_RESULT_DONE):
+            raise ProbeError(f"unexpected LDAP response {data[:16].hex()}")
+        if op_tag == SEARCH_RESULT_DONE:
+            return op[2] if len(op) > 2 else 0
+    return -1
+
+
+def _connect(host: str, port: int, deadline: float) -> socket.socket:
+    """Open a non-blocking TCP connection, waiting for it until deadline."""
+    family, kind, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    sock = socket.socket(family, kind, proto)
+    sock.setblocking(False)
+    try:
+        err = sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EAGAIN):
+            raise ProbeUnreachableError(f"connect to port {port}: {errno.errorcode.get(err, err)}")
+        _, writable, _ = select.select([], [sock], [], max(deadline - time.monotonic(), 0))
+        if not writable:
+            raise ProbeTimeoutError(f"connect to port {port} timed out")
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise ProbeUnreachableError(f"connect to port {port}: {errno.errorcode.get(err, err)}")
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _search(sock: socket.socket, deadline: float) -> int:
+    """Search the root DSE and return the result code."""
+    sock.sendall(ROOT_DSE_REQUEST)
+    data = b""
+    while (code := _search_done(data)) < 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout()
+        sock.settimeout(remaining)
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ProbeError("connection closed before the search completed")
+        data += chunk
+    try:
+        sock.sendall(UNBIND)
+    except OSError:
+        pass
+    return code
+
+
+def sample(host: str, port: int, tls: bool = False, timeout: float = TIMEOUT) -> Dict[str, float]:
+    """Time one connection and root DSE search.
+
+    Args:
+        host: LDAP server address.
+        port: LDAP or LDAPS port.
+        tls: Whether the port expects a TLS handshake first.
+        timeout: Time allowed for the whole exchange, in seconds.
+
+    Returns:
+        Dict[str, float]: Duration in seconds of each step.
+
+    Raises:
+        ProbeUnreachableError: If the connection is refused or times out.
+        ProbeError: If the answer is not LDAP.
+    """
+    steps = {}
+    start = time.monotonic()
+    deadline = start + timeout
+    sock = _connect(host, port, deadline)
+    steps["connect"] = time.monotonic() - start
+    try:
+        if tls:
+            # The certificate is self-signed by default; only liveness is checked here
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            sock.settimeout(max(deadline - time.monotonic(), 0))
+            sock = context.wrap_socket(sock)
+            steps["tls"] = time.monotonic() - start - steps["connect"]
+        mark = time.monotonic()
+        _search(sock, deadline)
+        steps["search"] = time.monotonic() - mark
+    except socket.timeout:
+        raise ProbeTimeoutError(f"no LDAP answer on port {port} within {timeout:g}s")
+    except (ssl.SSLError, OSError) as e:
+        raise ProbeError(f"LDAP exchange on port {port} failed: {e}")
+    finally:
+        sock.close()
+    return steps
+
+
+def probe(
+    host: str, port: int, tls: bool = False, samples: int = SAMPLES, timeout: float = TIMEOUT
+) -> ProbeResult:
+    """Take a few samples of the LDAP server latency.
+
+    Args:
+        host: LDAP server address.
+        port: LDAP or LDAPS port.
+        tls: Whether the port expects a TLS handshake first.
+        samples: Number of connections to time.
+        timeout: Time allowed for each connection, in seconds.
+
+    Returns:
+        ProbeResult: Step durations of every sample.
+
+    Raises:
+        ProbeUnreachableError: If the connection is refused or times out.
+        ProbeError: If the answer is not LDAP.
+    """
+    return ProbeResult([sample(host, port, tls, timeout) for _ in range(samples)])
@@ -0,0 +1,105 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Opt-in cProfile capture of slow hooks.
+
+Profiling is enabled by the GLAUTH_PROFILE environment variable, or by the marker file
+the charm writes when the profile-hooks option is set. Either holds the latency threshold
+in seconds: profiles of faster hooks are discarded. Kept profiles go to a ring directory
+in the charm directory, oldest first out once it grows beyond MAX_BYTES or MAX_FILES.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pathlib
+import pstats
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ENV_VAR = "GLAUTH_PROFILE"
+MARKER = ".profile-threshold"
+PROFILES_DIR = ".profiles"
+MAX_BYTES = 16 * 1024 * 1024
+MAX_FILES = 20
+
+
+def charm_dir() -> pathlib.Path:
+    """Return the charm directory, as ops determines it."""
+    default = pathlib.Path(__file__).resolve().parent.parent
+    return pathlib.Path(os.environ.get("JUJU_CHARM_DIR", default))
+
+
+def threshold(directory: pathlib.Path) -> Optional[float]:
+    """Return the latency threshold in seconds, or None when profiling is disabled."""
+    value = os.environ.get(ENV_VAR)
+    if value is None:
+        try:
+            value = (directory / MARKER).read_text()
+        except OSError:
+            return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning("invalid profiling threshold %r", value)
+        return None
+
+
+def enable(directory: pathlib.Path, seconds: Optional[float]) -> None:
+    """Write, or with None remove, the marker enabling profiling from the next hook."""
+    marker = directory / MARKER
+    if seconds is None:
+        marker.unlink(missing_ok=True)
+    else:
+        marker.write_text(str(seconds))
+
+
+def _prune(profiles: pathlib.Path) -> None:
+    """Remove the oldest profiles until the directory is within its bounds."""
+    files = sorted(profiles.glob("*.pstats"))
+    total = sum(path.stat().st_size for path in files)
+    while files and (total > MAX_BYTES or len(files) > MAX_FILES):
+        oldest = files.pop(0)
+        total -= oldest.stat().st_size
+        oldest.unlink()
+
+
+def run(main: Callable, *args, **kwargs) -> None:
+    """Call main, profiling it if enabled and keeping the profile if it was slow."""
+    directory = charm_dir()
+    limit = threshold(directory)
+    if limit is None:
+        main(*args, **kwargs)
+        return
+
+    profiler = cProfile.Profile()
+    start = time.monotonic()
+    try:
+        profiler.runcall(main, *args, **kwargs)
+    finally:
+        elapsed = time.monotonic() - start
+        if elapsed >= limit:
+            profiles = directory / PROFILES_DIR
+            profiles.mkdir(exist_ok=True)
+            event = os.path.basename(os.environ.get("JUJU_DISPATCH_PATH", "")) or "unknown"
+            path = profiles / f"{time.time_ns()}-{event}.pstats"
+            profiler.dump_stats(path)
+            _prune(profiles)
+            logger.info("%s took %.2fs, profile saved to %s", event, elapsed, path)
+
+
+def latest(directory: pathlib.Path) -> Optional[pathlib.Path]:
+    """Return the profile of the last slow hook, if any."""
+    files = sorted((directory / PROFILES_DIR).glob("*.pstats"))
+    return files[-1] if files else None
+
+
+def top(path: pathlib.Path, count: int) -> str:
+    """Return the count functions with the highest cumulative time in a profile."""
+    stream = io.StringIO()
+    stats = pstats.Stats(str(path), stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(count)
+    return stream.getvalue()
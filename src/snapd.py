@@ -0,0 +1,795 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""snapd REST API backend and lean snap cache, on top of the vendored snap library.
+
+The vendored `charms.operator_libs_linux.v1.snap` library is kept as fetched from Charmhub;
+what glauth needs beyond it lives here, in subclasses of its `Snap`, `SnapClient` and
+`SnapCache`:
+
+- `SnapClient` keeps one keep-alive connection to snapd, and submits the asynchronous
+  requests (install, refresh, remove, start, stop, restart, set config) whose changes can
+  be followed with `get_change` or `wait_change`.
+- `Snap` takes `backend=SnapBackend.API` to carry out operations through that client
+  instead of forking the `snap` command, and `wait=False` to only submit them.
+- `SnapCache` indexes the snapd names catalog in place, and with `names` only loads the
+  snaps it is asked for.
+"""
+
+import http.client
+import json
+import logging
+import mmap
+import os
+import select
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from charms.operator_libs_linux.v1 import snap
+
+logger = logging.getLogger(__name__)
+
+# Sorted list of every snap name in the store, refreshed periodically by snapd
+SNAPD_NAMES_CATALOG = "/var/cache/snapd/names"
+
+
+class SnapBackend(Enum):
+    """How snap operations are carried out.
+
+    `CLI` forks the `snap` command; `API` talks to the snapd REST API directly.
+    """
+
+    CLI = "cli"
+    API = "api"
+
+
+class SnapClient(snap.SnapClient):
+    """snapd API client sharing one HTTP/1.1 keep-alive connection across requests.
+
+    The connection is re-established transparently if snapd closes it. When an opener is
+    given, requests go through it as in the base client instead.
+    """
+
+    def __init__(
+        self,
+        socket_path: str = "/run/snapd.socket",
+        opener=None,
+        base_url: str = "http://localhost/v2/",
+        timeout: float = 5.0,
+    ):
+        super().__init__(socket_path, opener, base_url, timeout)
+        # The base client builds a urllib opener when none is given; use the pool instead
+        self.opener = opener
+        self.socket_path = socket_path
+        self._connection: Optional[http.client.HTTPConnection] = None
+        self.stats = {"requests": 0, "connects": 0, "bytes": 0, "seconds": 0.0}
+
+    def close(self) -> None:
+        """Close the pooled connection to snapd, if any."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _request(self, method: str, path: str, query: Dict = None, body: Dict = None):
+        """Make a JSON request and return the decoded result."""
+        return self._request_document(method, path, query, body)["result"]
+
+    def _request_async(self, method: str, path: str, query: Dict = None, body: Dict = None):
+        """Make a JSON request that snapd runs in the background; return its change ID."""
+        return self._request_document(method, path, query, body)["change"]
+
+    def _request_document(
+        self, method: str, path: str, query: Dict = None, body: Dict = None
+    ) -> Dict:
+        """Make a JSON request and return the whole decoded response."""
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        return json.loads(self._request_raw(method, path, query, headers, data).decode())
+
+    def _request_raw(
+        self,
+        method: str,
+        path: str,
+        query: Dict = None,
+        headers: Dict = None,
+        data: bytes = None,
+    ) -> bytes:
+        """Make a request to snapd and return the raw response body."""
+        url = self.base_url + path
+        if query:
+            url = url + "?" + urllib.parse.urlencode(query)
+
+        start = time.monotonic()
+        try:
+            if self.opener is not None:
+                response = self._open(url, method, headers or {}, data)
+            else:
+                response = self._send(url, method, headers or {}, data)
+        finally:
+            self.stats["requests"] += 1
+            self.stats["seconds"] += time.monotonic() - start
+        self.stats["bytes"] += len(response)
+        return response
+
+    def _open(self, url: str, method: str, headers: Dict, data: bytes) -> bytes:
+        """Send a request through the configured urllib opener."""
+        request = urllib.request.Request(url, method=method, data=data, headers=headers)
+        try:
+            return self.opener.open(request, timeout=self.timeout).read()
+        except urllib.error.HTTPError as e:
+            raise self._api_error(e.code, e.reason, e.read)
+        except urllib.error.URLError as e:
+            raise snap.SnapAPIError({}, 500, "Not found", e.reason)
+
+    def _send(self, url: str, method: str, headers: Dict, data: bytes) -> bytes:
+        """Send a request over the pooled keep-alive connection.
+
+        A request is only sent again if it cannot have reached snapd: when writing it to a
+        reused connection fails, or, for GET, when the reused connection drops before the
+        response. Anything else, e.g. an install whose response was lost, is raised rather
+        than risk snapd acting on it twice.
+        """
+        target = urllib.parse.urlsplit(url)
+        target = target.path + ("?" + target.query if target.query else "")
+
+        if self._connection is not None and self._dropped():
+            # snapd closed the idle connection: reconnect rather than write into it
+            logger.debug("snapd connection closed while idle, reconnecting")
+            self.close()
+
+        while True:
+            reused = self._connection is not None
+            if not reused:
+                self._connection = snap._UnixSocketConnection(
+                    "localhost", timeout=self.timeout, socket_path=self.socket_path
+                )
+                self.stats["connects"] += 1
+            sent = False
+            try:
+                self._connection.request(method, target, body=data, headers=headers)
+                sent = True
+                response = self._connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError) as e:
+                self.close()
+                if not reused or (sent and method != "GET"):
+                    raise snap.SnapAPIError({}, 500, "Not found", str(e))
+                logger.debug("snapd connection closed (%s), reconnecting", e)
+            except OSError as e:
+                self.close()
+                raise snap.SnapAPIError({}, 500, "Not found", str(e))
+
+        if response.will_close:
+            self.close()
+        if response.status >= 400:
+            raise self._api_error(response.status, response.reason, lambda: body)
+        return body
+
+    def _dropped(self) -> bool:
+        """Whether snapd has hung up the idle pooled connection."""
+        sock = self._connection.sock
+        if sock is None:
+            return True
+        # Nothing is pending between requests, so a readable socket can only mean EOF
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+
+    @staticmethod
+    def _api_error(code: int, status: str, read: Callable[[], bytes]) -> snap.SnapAPIError:
+        """Build a SnapAPIError from an HTTP error response."""
+        message = ""
+        try:
+            body = json.loads(read().decode())["result"]
+        except (IOError, ValueError, KeyError) as e:
+            # Will only happen on read error or if snapd sends invalid JSON
+            body = {}
+            message = f"{type(e).__name__} - {e}"
+        return snap.SnapAPIError(body, code, status, message)
+
+    def get_installed_snap_information(self, name: str) -> Dict:
+        """Query snapd for information about a single installed snap."""
+        return self._request("GET", f"snaps/{urllib.parse.quote(name)}")
+
+    def snap_action(self, name: str, action: str, **options) -> str:
+        """Ask snapd to install, refresh or remove a snap.
+
+        Args:
+            name: Name of the snap.
+            action: One of "install", "refresh" or "remove".
+            options: Extra fields for the request, e.g. channel="edge", classic=True.
+
+        Returns:
+            str: The snapd change ID.
+        """
+        body = {"action": action, **options}
+        return self._request_async("POST", f"snaps/{urllib.parse.quote(name)}", body=body)
+
+    def app_action(self, names: List[str], action: str, **options) -> str:
+        """Ask snapd to start, stop or restart snap apps.
+
+        Args:
+            names: Snap names or "snap.app" names to act on.
+            action: One of "start", "stop" or "restart".
+            options: Extra fields for the request, e.g. enable=True, reload=True.
+
+        Returns:
+            str: The snapd change ID.
+        """
+        return self._request_async(
+            "POST", "apps", body={"action": action, "names": names, **options}
+        )
+
+    def get_snap_config(self, name: str, keys: List[str]) -> Dict:
+        """Get configuration values of a snap."""
+        path = f"snaps/{urllib.parse.quote(name)}/conf"
+        return self._request("GET", path, {"keys": ",".join(keys)})
+
+    def set_snap_config(self, name: str, config: Dict) -> str:
+        """Set configuration values of a snap, None unsetting a key; return the change ID."""
+        return self._request_async("PUT", f"snaps/{urllib.parse.quote(name)}/conf", body=config)
+
+    def get_change(self, change_id: str) -> Dict:
+        """Get the status of a snapd change."""
+        return self._request("GET", f"changes/{change_id}")
+
+    def wait_change(self, change_id: str, timeout: Optional[float] = None) -> Dict:
+        """Poll a snapd change until it is ready.
+
+        Args:
+            change_id: ID returned by an asynchronous request.
+            timeout: Seconds to wait before giving up. Waits forever by default.
+
+        Returns:
+            dict: The change as last reported by snapd.
+
+        Raises:
+            SnapError: If the change failed or did not finish in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.1
+        while True:
+            change = self.get_change(change_id)
+            if change.get("ready"):
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise snap.SnapError(f"Timed out waiting for snapd change {change_id}")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+        if change.get("status") != "Done":
+            raise snap.SnapError(
+                "snapd change {} ({}) failed: {}".format(
+                    change_id, change.get("summary", ""), change.get("err", change.get("status"))
+                )
+            )
+        return change
+
+
+def _submit_change(description: str, request: Callable[[], Optional[str]]) -> Optional[str]:
+    """Submit a snapd API request and return the resulting change ID.
+
+    Args:
+        description: What is being done, for error messages.
+        request: Submits the request and returns its change ID, or None if there was
+            nothing to do.
+
+    Raises:
+        SnapError: If the request was refused.
+    """
+    try:
+        return request()
+    except snap.SnapAPIError as e:
+        reason = e.body.get("message") if isinstance(e.body, dict) else None
+        raise snap.SnapError(f"{description} failed: {reason or e.message}")
+
+
+def _wait_change(
+    client: SnapClient, description: str, request: Callable[[], Optional[str]]
+) -> Dict:
+    """Submit a snapd API request and wait for the resulting change.
+
+    Args:
+        client: Client the request is submitted with.
+        description: What is being done, for error messages.
+        request: Submits the request and returns its change ID.
+
+    Raises:
+        SnapError: If the request was refused or the change failed.
+    """
+    change_id = _submit_change(description, request)
+    if change_id is None:
+        # Nothing for snapd to do
+        return {}
+    try:
+        return client.wait_change(change_id)
+    except snap.SnapAPIError as e:
+        reason = e.body.get("message") if isinstance(e.body, dict) else None
+        raise snap.SnapError(f"{description} failed: {reason or e.message}")
+
+
+class Snap(snap.Snap):
+    """A snap whose operations can go through the snapd API.
+
+    Besides the properties of the base class, exposes the version published with the
+    installed revision, if snapd reported it.
+    """
+
+    def __init__(
+        self,
+        name,
+        state: snap.SnapState,
+        channel: str,
+        revision: str,
+        confinement: str,
+        apps: Optional[List[Dict[str, str]]] = None,
+        cohort: Optional[str] = "",
+        snap_client: Optional[SnapClient] = None,
+        version: Optional[str] = None,
+    ) -> None:
+        super().__init__(name, state, channel, revision, confinement, apps, cohort)
+        self._snap_client = snap_client or SnapClient()
+        self._version = version
+
+    @property
+    def version(self) -> Optional[str]:
+        """Return the version of the snap, if known."""
+        return self._version
+
+    def _snap_api(
+        self, description: str, request: Callable[[], Optional[str]], wait: bool = True
+    ) -> Optional[str]:
+        """Submit a snapd API request and, by default, wait for the resulting change.
+
+        Args:
+            description: What is being done, for error messages.
+            request: Submits the request and returns its change ID.
+            wait: Whether to wait for the change. If False, return the change ID straight away.
+
+        Raises:
+            SnapError: If there is a problem encountered.
+        """
+        description = f"Snap: {self._name!r}; {description}"
+        if not wait:
+            return _submit_change(description, request)
+        _wait_change(self._snap_client, description, request)
+        return None
+
+    def _app_names(self, services: Optional[List[str]] = None) -> List[str]:
+        """Return the snapd app names for the given services, or the whole snap."""
+        if services:
+            return [f"{self._name}.{service}" for service in services]
+        return [self._name]
+
+    def get(self, key, backend: SnapBackend = SnapBackend.CLI) -> str:
+        """Get a snap configuration value.
+
+        Args:
+            key: The key to retrieve.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().get(key)
+        try:
+            value = self._snap_client.get_snap_config(self._name, [key])[key]
+        except (snap.SnapAPIError, KeyError) as e:
+            raise snap.SnapError(f"Snap: {self._name!r}; could not get {key!r}: {e}")
+        return value if isinstance(value, str) else json.dumps(value)
+
+    def set(self, config: Dict, backend: SnapBackend = SnapBackend.CLI) -> str:
+        """Set snap configuration values.
+
+        Args:
+            config: Keys and values to set.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().set(config)
+        self._snap_api(
+            f"set {config}", lambda: self._snap_client.set_snap_config(self._name, config)
+        )
+        return ""
+
+    def unset(self, key, backend: SnapBackend = SnapBackend.CLI) -> str:
+        """Unset a snap configuration value.
+
+        Args:
+            key: The key to unset.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().unset(key)
+        self._snap_api(
+            f"unset {key}", lambda: self._snap_client.set_snap_config(self._name, {key: None})
+        )
+        return ""
+
+    def start(
+        self,
+        services: Optional[List[str]] = None,
+        enable: Optional[bool] = False,
+        backend: SnapBackend = SnapBackend.CLI,
+    ) -> None:
+        """Start the services of the snap.
+
+        Args:
+            services: Services to start, all of them if not given.
+            enable: Whether to also enable the services.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().start(services, enable)
+        names = self._app_names(services)
+        self._snap_api(
+            f"start {names}",
+            lambda: self._snap_client.app_action(names, "start", enable=bool(enable)),
+        )
+
+    def stop(
+        self,
+        services: Optional[List[str]] = None,
+        disable: Optional[bool] = False,
+        backend: SnapBackend = SnapBackend.CLI,
+    ) -> None:
+        """Stop the services of the snap.
+
+        Args:
+            services: Services to stop, all of them if not given.
+            disable: Whether to also disable the services.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().stop(services, disable)
+        names = self._app_names(services)
+        self._snap_api(
+            f"stop {names}",
+            lambda: self._snap_client.app_action(names, "stop", disable=bool(disable)),
+        )
+
+    def restart(
+        self,
+        services: Optional[List[str]] = None,
+        reload: Optional[bool] = False,
+        backend: SnapBackend = SnapBackend.CLI,
+    ) -> None:
+        """Restart the services of the snap.
+
+        Args:
+            services: Services to restart, all of them if not given.
+            reload: Whether to use the reload command of the services, if available.
+            backend: Whether to use the `snap` command or the snapd API.
+        """
+        if backend is SnapBackend.CLI:
+            return super().restart(services, reload)
+        names = self._app_names(services)
+        self._snap_api(
+            f"restart {names}",
+            lambda: self._snap_client.app_action(names, "restart", reload=bool(reload)),
+        )
+
+    def _install(
+        self,
+        channel: Optional[str] = "",
+        cohort: Optional[str] = "",
+        backend: SnapBackend = SnapBackend.CLI,
+        wait: bool = True,
+    ) -> Optional[str]:
+        """Add the snap to the system; without waiting, return the snapd change ID."""
+        if backend is SnapBackend.CLI:
+            return super()._install(channel, cohort)
+        cohort = cohort or self._cohort
+        options = {}
+        if self.confinement == "classic":
+            options["classic"] = True
+        if channel:
+            options["channel"] = channel
+        if cohort:
+            options["cohort-key"] = cohort
+        return self._snap_api(
+            "install",
+            lambda: self._snap_client.snap_action(self._name, "install", **options),
+            wait,
+        )
+
+    def _refresh(
+        self,
+        channel: Optional[str] = "",
+        cohort: Optional[str] = "",
+        leave_cohort: Optional[bool] = False,
+        backend: SnapBackend = SnapBackend.CLI,
+        wait: bool = True,
+    ) -> Optional[str]:
+        """Refresh the snap; without waiting, return the snapd change ID."""
+        if backend is SnapBackend.CLI:
+            return super()._refresh(channel, cohort, leave_cohort)
+        options = {"channel": channel} if channel else {}
+        if leave_cohort:
+            self._cohort = ""
+            options["leave-cohort"] = True
+        elif cohort or self._cohort:
+            options["cohort-key"] = cohort or self._cohort
+
+        def request() -> Optional[str]:
+            try:
+                return self._snap_client.snap_action(self._name, "refresh", **options)
+            except snap.SnapAPIError as e:
+                # Like `snap refresh`, an up-to-date snap is not an error
+                kind = e.body.get("kind") if isinstance(e.body, dict) else None
+                if kind == "snap-no-update-available":
+                    return None
+                raise
+
+        return self._snap_api("refresh", request, wait)
+
+    def _remove(self, backend: SnapBackend = SnapBackend.CLI, wait: bool = True) -> str:
+        """Remove the snap from the system; without waiting, return the snapd change ID."""
+        if backend is SnapBackend.CLI:
+            return super()._remove()
+        change = self._snap_api(
+            "remove", lambda: self._snap_client.snap_action(self._name, "remove"), wait
+        )
+        return change or ""
+
+    def ensure(
+        self,
+        state: snap.SnapState,
+        classic: Optional[bool] = False,
+        channel: Optional[str] = "",
+        cohort: Optional[str] = "",
+        backend: SnapBackend = SnapBackend.CLI,
+        wait: bool = True,
+    ) -> Optional[str]:
+        """Ensure that the snap is in a given state.
+
+        Args:
+            state: The `SnapState` to reconcile to.
+            classic: Whether classic confinement should be used.
+            channel: The channel to install from.
+            cohort: The key of a snap cohort.
+            backend: Whether to use the `snap` command or the snapd API.
+            wait: With the API backend, pass False to submit the change to snapd and return
+                its ID straight away; follow it with `SnapClient.get_change`.
+
+        Returns:
+            Optional[str]: The snapd change ID when not waiting.
+
+        Raises:
+            SnapError: If an error is encountered.
+        """
+        if not wait and backend is not SnapBackend.API:
+            raise ValueError("only the snapd API backend can ensure without waiting")
+
+        change = None
+        self._confinement = "classic" if classic or self._confinement == "classic" else ""
+        installed = self._state in (snap.SnapState.Present, snap.SnapState.Latest)
+        if state not in (snap.SnapState.Present, snap.SnapState.Latest):
+            if installed:
+                change = self._remove(backend, wait) or None
+        elif not installed:
+            change = self._install(channel, cohort, backend=backend, wait=wait)
+        else:
+            change = self._refresh(channel, cohort, backend=backend, wait=wait)
+
+        if change is not None:
+            # snapd is still working on it; the caller follows the change from here
+            return change
+
+        self._update_snap_apps()
+        self._state = state
+        return None
+
+
+class _SnapCatalog:
+    """Read-only view of the snapd names catalog backed by `mmap`.
+
+    snapd writes the catalog sorted, one name per line, so lookups are answered by a binary
+    search over the mapped file instead of loading tens of thousands of names into a dict.
+    Catalogs are shared per path and rebuilt only when the file's mtime changes.
+    """
+
+    _catalogs: Dict[str, "_SnapCatalog"] = {}
+
+    def __init__(self, path: str, mtime: int):
+        self.path = path
+        self.mtime = mtime
+        self._len = None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # mmap refuses to map empty files
+                self._map = b""
+
+    @classmethod
+    def load(cls, path: str) -> Optional["_SnapCatalog"]:
+        """Return the catalog for path, reusing the previous index if the file is unchanged."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        catalog = cls._catalogs.get(path)
+        if catalog is None or catalog.mtime != mtime:
+            catalog = cls(path, mtime)
+            cls._catalogs[path] = catalog
+        return catalog
+
+    def _line(self, pos: int) -> Tuple[int, int]:
+        """Return the start and end offsets of the line containing pos."""
+        start = self._map.rfind(b"\n", 0, pos) + 1
+        end = self._map.find(b"\n", pos)
+        if end == -1:
+            end = len(self._map)
+        return start, end
+
+    def __contains__(self, name: str) -> bool:
+        """Binary search the mapped catalog for name."""
+        key = name.encode()
+        lo, hi = 0, len(self._map)
+        while lo < hi:
+            start, end = self._line((lo + hi) // 2)
+            line = self._map[start:end].strip()
+            if line == key:
+                return True
+            if line < key:
+                lo = end + 1
+            else:
+                hi = start
+        return False
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the names in the catalog."""
+        pos = 0
+        while pos < len(self._map):
+            start, end = self._line(pos)
+            line = self._map[start:end].strip()
+            if line:
+                yield line.decode()
+            pos = end + 1
+
+    def __len__(self) -> int:
+        """Return the number of names in the catalog."""
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+
+class SnapCache(snap.SnapCache):
+    """Installed and available snaps, with the names catalog indexed in place.
+
+    If names is given, the cache only tracks those snaps: nothing is read up front, and each
+    snap is loaded on first access from `/v2/snaps/{name}` (or the store if it is not
+    installed). An existing `SnapClient` may be passed in to share its connection to snapd.
+    """
+
+    def __init__(
+        self,
+        names: Optional[Iterable[str]] = None,
+        snap_client: Optional[SnapClient] = None,
+    ):
+        # Not chained to the base class, which loads everything with a client of its own
+        if not self.snapd_installed:
+            raise snap.SnapError("snapd is not installed or not in /usr/bin") from None
+        self._snap_client = snap_client or SnapClient()
+        self._snap_map = {}
+        self._catalog: Optional[_SnapCatalog] = None
+        self._names = None if names is None else set(names)
+        if self._names is None:
+            self._load_available_snaps()
+            self._load_installed_snaps()
+
+    def __contains__(self, key: str) -> bool:
+        """Return whether the snap is installed or available."""
+        if self._names is not None:
+            return key in self._names
+        return key in self._snap_map or (self._catalog is not None and key in self._catalog)
+
+    def __len__(self) -> int:
+        """Return the number of installed and available snaps."""
+        if self._catalog is None:
+            return len(self._snap_map)
+        return len(self._catalog) + sum(1 for name in self._snap_map if name not in self._catalog)
+
+    def __iter__(self) -> Iterator[Optional[Snap]]:
+        """Iterate over the loaded snaps, then None for each catalog entry not loaded yet."""
+        yield from self._snap_map.values()
+        if self._catalog is not None:
+            for name in self._catalog:
+                if name not in self._snap_map:
+                    yield None
+
+    def __getitem__(self, snap_name: str) -> Snap:
+        """Return either the installed version or latest version of a snap."""
+        if self._names is None or self._snap_map.get(snap_name) is not None:
+            return super().__getitem__(snap_name)
+        try:
+            self._snap_map[snap_name] = self._load_snap(snap_name)
+        except snap.SnapAPIError:
+            raise snap.SnapNotFoundError(f"Snap '{snap_name}' not found!")
+        return self._snap_map[snap_name]
+
+    def _load_available_snaps(self) -> None:
+        """Index the available snaps on disk; they are loaded lazily if asked for."""
+        # snapd updates the catalog infrequently, so it may not exist yet
+        self._catalog = _SnapCatalog.load(SNAPD_NAMES_CATALOG)
+
+    def _snap(self, info: Dict, state: snap.SnapState, apps=None) -> Snap:
+        """Return a snap described by snapd, sharing the connection of the cache."""
+        return Snap(
+            name=info["name"],
+            state=state,
+            channel=info["channel"],
+            revision=info["revision"],
+            confinement=info["confinement"],
+            apps=apps,
+            snap_client=self._snap_client,
+            version=info.get("version"),
+        )
+
+    def _load_installed_snaps(self) -> None:
+        """Load the installed snaps into the dict."""
+        for info in self._snap_client.get_installed_snaps():
+            self._snap_map[info["name"]] = self._snap(
+                info, snap.SnapState.Latest, info.get("apps", None)
+            )
+
+    def _load_snap(self, name: str) -> Snap:
+        """Load a single snap, falling back to the store if it is not installed."""
+        try:
+            info = self._snap_client.get_installed_snap_information(name)
+        except snap.SnapAPIError as e:
+            if e.code != 404:
+                raise
+            return self._load_info(name)
+        return self._snap(info, snap.SnapState.Latest, info.get("apps", None))
+
+    def _load_info(self, name: str) -> Snap:
+        """Load info for a snap which is not installed."""
+        return self._snap(self._snap_client.get_snap_information(name), snap.SnapState.Available)
+
+
+def _system_set(config_item: str, value: str) -> None:
+    """Set a snap system config value through the snapd API."""
+    client = SnapClient()
+    try:
+        _wait_change(
+            client,
+            f"Setting system config '{config_item}' to '{value}'",
+            lambda: client.set_snap_config("system", {config_item: value}),
+        )
+    finally:
+        client.close()
+
+
+def hold_refresh(days: int = 90, backend: SnapBackend = SnapBackend.CLI) -> None:
+    """Set the system-wide snap refresh hold.
+
+    Args:
+        days: Number of days to hold system refreshes for. Maximum 90. Zero removes the hold.
+        backend: Whether to use the `snap` command or the snapd API.
+    """
+    if backend is SnapBackend.CLI:
+        snap.hold_refresh(days)
+        return
+    # Currently the snap daemon can only hold for a maximum of 90 days
+    if not isinstance(days, int) or days > 90:
+        raise ValueError("days must be an int between 1 and 90")
+    if days == 0:
+        _system_set("refresh.hold", "")
+        logger.info("Removed system-wide snap refresh hold")
+        return
+    target_date = datetime.now(timezone.utc).astimezone() + timedelta(days=days)
+    hold_date = target_date.strftime("%Y-%m-%dT%H:%M:%S%z")
+    # Python dumps the offset in format '+0100', snapd wants '+01:00'
+    hold_date = f"{hold_date[:-2]}:{hold_date[-2:]}"
+    _system_set("refresh.hold", hold_date)
+    logger.info("Set system-wide snap refresh hold to: %s", hold_date)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Measure ldap-client hook time as the number of related applications grows.
+
+Times a unit joining an already published relation, and a config change that has to be
+published to every relation. Glauth, its LDAP probe and the config resource are stubbed out.
+Run with: PYTHONPATH=lib:src python tests/benchmark/bench_relation_fanout.py
+"""
+
+import statistics
+import time
+from unittest.mock import patch
+
+import probe
+from charm import GlauthCharm
+from ops.testing import Harness
+
+RELATIONS = (1, 10, 100)
+ROUNDS = 5
+
+
+def _harness(relations: int) -> Harness:
+    harness = Harness(GlauthCharm)
+    harness.set_leader(True)
+    harness.update_config({"ldap-search-base": "dc=glauth,dc=com"})
+    harness.begin()
+    peer = harness.add_relation("glauth", "glauth")
+    for label in ("ca-cert", "ldap-default-bind-dn", "ldap-password"):
+        secret = harness.charm.app.add_secret({label: "value"}, label=label)
+        harness.update_relation_data(peer, "glauth", {label: secret.id})
+    for i in range(relations):
+        relation = harness.add_relation("ldap-client", f"sssd{i}")
+        harness.add_relation_unit(relation, f"sssd{i}/0")
+    return harness
+
+
+def _time(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Print median join and config-changed hook times for each relation count."""
+    stubs = [
+        patch("glauth.reconcile", return_value=("none", {})),
+        patch("glauth.create_default_config", return_value=False),
+        patch("probe.probe", return_value=probe.ProbeResult([{"search": 0.001}])),
+    ]
+    for p in stubs:
+        p.start()
+    for relations in RELATIONS:
+        harness = _harness(relations)
+        relation = harness.model.relations["ldap-client"][0].id
+        joins = [
+            _time(lambda n=n: harness.add_relation_unit(relation, f"sssd0/{n}"))
+            for n in range(1, ROUNDS + 1)
+        ]
+        changes = [
+            _time(lambda n=n: harness.update_config({"ldap-search-base": f"dc=glauth{n},dc=com"}))
+            for n in range(ROUNDS)
+        ]
+        harness.cleanup()
+        print(
+            "{:>4} relations  join {:>8.2f} ms  config-changed {:>8.2f} ms".format(
+                relations, statistics.median(joins) * 1000, statistics.median(changes) * 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
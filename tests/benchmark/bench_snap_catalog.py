@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compare SnapCache construction against a 50k-line snapd names catalog.
+
+Each variant runs in a fresh child process so that peak RSS is not polluted by the other.
+Run with: PYTHONPATH=lib:src python tests/benchmark/bench_snap_catalog.py
+"""
+
+import multiprocessing
+import random
+import resource
+import string
+import tempfile
+import time
+from unittest.mock import patch
+
+import snapd
+
+NAMES = 50_000
+ROUNDS = 20
+
+
+def _legacy_load(self) -> None:
+    """SnapCache._load_available_snaps as it was before the mmap index."""
+    with open(snapd.SNAPD_NAMES_CATALOG, "r") as f:
+        for line in f:
+            if line.strip():
+                self._snap_map[line.strip()] = None
+
+
+def _construct(catalog: str, legacy: bool, queue: multiprocessing.Queue) -> None:
+    patches = [
+        patch.object(snapd, "SNAPD_NAMES_CATALOG", catalog),
+        patch.object(snapd.SnapCache, "snapd_installed", True),
+        patch.object(snapd.SnapClient, "get_installed_snaps", return_value=[]),
+    ]
+    if legacy:
+        patches.append(patch.object(snapd.SnapCache, "_load_available_snaps", _legacy_load))
+    for p in patches:
+        p.start()
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    caches = []
+    for _ in range(ROUNDS):
+        # Keep every cache alive, as a hook holding on to its cache would
+        caches.append(snapd.SnapCache())
+        assert "glauth" in caches[-1]
+    elapsed = (time.perf_counter() - start) / ROUNDS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    queue.put((elapsed, rss))
+
+
+def main() -> None:
+    """Run both variants and print construction time and RSS growth."""
+    names = {"glauth"}
+    while len(names) < NAMES:
+        names.add("".join(random.choices(string.ascii_lowercase + "-", k=random.randint(3, 24))))
+    with tempfile.NamedTemporaryFile("w", suffix=".names") as catalog:
+        catalog.write("\n".join(sorted(names)) + "\n")
+        catalog.flush()
+
+        ctx = multiprocessing.get_context("fork")
+        for label, legacy in (("dict (legacy)", True), ("mmap index", False)):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_construct, args=(catalog.name, legacy, queue))
+            proc.start()
+            elapsed, rss = queue.get()
+            proc.join()
+            print(
+                "{:<14} {:>8.2f} ms/SnapCache()  {:>8} KiB RSS growth over {} caches".format(
+                    label, elapsed * 1000, rss, ROUNDS
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
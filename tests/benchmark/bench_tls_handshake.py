@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Measure TLS handshakes per second against a local listener for each certificate profile.
+
+The listener stands in for the glauth LDAPS port: it completes the handshake and hangs up, so
+the numbers reflect the server's private-key cost rather than LDAP processing.
+Run with: PYTHONPATH=lib:src python tests/benchmark/bench_tls_handshake.py
+"""
+
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+
+import glauth
+
+DURATION = 2.0
+
+
+def _serve(listener: socket.socket, context: ssl.SSLContext, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            continue
+        try:
+            with context.wrap_socket(conn, server_side=True):
+                pass
+        except (ssl.SSLError, OSError):
+            conn.close()
+
+
+def _handshakes(key_type: str, tmp: str) -> float:
+    key_pem, cert_pem = glauth.generate_certificate(key_type, "localhost")
+    cert, key = os.path.join(tmp, f"{key_type}.crt"), os.path.join(tmp, f"{key_type}.key")
+    with open(cert, "wb") as f:
+        f.write(cert_pem)
+    with open(key, "wb") as f:
+        f.write(key_pem)
+
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert, key)
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.load_verify_locations(cert)
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    listener.settimeout(0.1)
+    stop = threading.Event()
+    server = threading.Thread(target=_serve, args=(listener, server_context, stop))
+    server.start()
+    try:
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < DURATION:
+            with socket.create_connection(listener.getsockname()) as sock:
+                with client_context.wrap_socket(sock, server_hostname="localhost"):
+                    count += 1
+        return count / (time.perf_counter() - start)
+    finally:
+        stop.set()
+        server.join()
+        listener.close()
+
+
+def main() -> None:
+    """Run the handshake loop for every key type and print handshakes per second."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for key_type in glauth.KEY_TYPES:
+            print("{:<11} {:>8.0f} handshakes/s".format(key_type, _handshakes(key_type, tmp)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compare self-signed certificate generation time for each supported key type.
+
+Run with: PYTHONPATH=lib:src python tests/benchmark/bench_tls_keygen.py
+"""
+
+import statistics
+import time
+
+import glauth
+
+ROUNDS = 5
+
+
+def main() -> None:
+    """Generate a certificate with every key type and print timings."""
+    for key_type in glauth.KEY_TYPES:
+        timings = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            glauth.generate_certificate(key_type, "glauth-bench")
+            timings.append(time.perf_counter() - start)
+        print(
+            "{:<11} median {:>9.2f} ms  max {:>9.2f} ms".format(
+                key_type, statistics.median(timings) * 1000, max(timings) * 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A minimal stand-in for the snapd REST API served over a Unix socket."""
+
+import http.server
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+Route = Union[Tuple[Optional[int], Dict], Callable[[Dict], Tuple[Optional[int], Dict]]]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((self.command, url.path, url.query, body))
+
+        route = self.server.routes.get((self.command, url.path))
+        if route is None:
+            code, doc = 404, {"type": "error", "result": {"message": "not found"}}
+        elif callable(route):
+            code, doc = route(body)
+        else:
+            code, doc = route
+        if code is None:
+            # Hang up having taken the request, as if snapd died before responding
+            self.close_connection = True
+            return
+
+        payload = json.dumps(doc).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.server.drop_connections:
+            # Hang up without announcing it, like snapd closing an idle connection
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = _handle  # noqa: N815
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *_) -> None:
+        pass
+
+
+class FakeSnapd(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve canned snapd responses, keyed by (method, path), on a temporary socket.
+
+    Routes map to either a ``(status, document)`` tuple or a callable taking the decoded
+    request body and returning one; a status of None hangs up without responding. Requests
+    and connection counts are recorded.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, routes: Dict[Tuple[str, str], Route]):
+        self._dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self._dir.name, "snapd.socket")
+        self.routes = routes
+        self.requests: List[Tuple[str, str, str, Dict]] = []
+        self.connections = 0
+        self.drop_connections = False
+        super().__init__(self.socket_path, _Handler)
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving and remove the socket."""
+        self.shutdown()
+        self.server_close()
+        self._dir.cleanup()
+
+
+def sync(result) -> Tuple[int, Dict]:
+    """Return a synchronous snapd response document."""
+    return 200, {"type": "sync", "status-code": 200, "result": result}
@@ -4,12 +4,19 @@
 
 """Test default charm events such as upgrade charm, install, etc."""
 
+import pathlib
+import subprocess
+import time
 import unittest
 from unittest.mock import patch
 
+import instrumentation
+import probe
+import snapd
 from charm import GlauthCharm
-from ops.model import ActiveStatus
-from ops.testing import Harness
+from charms.operator_libs_linux.v1 import snap
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+from ops.testing import ActionFailed, Harness
 
 
 class TestCharm(unittest.TestCase):
@@ -21,10 +28,162 @@ class TestCharm(unittest.TestCase):
         self.addCleanup(self.harness.cleanup)
         self.harness.begin()
 
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
     @patch("glauth.version", return_value="v1.0.0")
     @patch("glauth.installed", return_value=True)
-    @patch("glauth.install")
-    def test_install(self, *_) -> None:
+    @patch("glauth.install", return_value="12")
+    def test_install(self, install, *_) -> None:
         """Test install behavior."""
         self.harness.charm.on.install.emit()
+        install.assert_called_once_with(wait=False)
+        self.assertIsInstance(self.harness.charm.unit.status, MaintenanceStatus)
+        with patch("glauth.change_progress", return_value=(False, "1/4 tasks")):
+            self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.charm.unit.status, MaintenanceStatus("waiting for glauth snap: 1/4 tasks")
+        )
+        with patch("glauth.change_progress", return_value=(True, "Install glauth")):
+            self.harness.charm.on.update_status.emit()
         self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        self.assertEqual(self.harness.get_workload_version(), "v1.0.0")
+
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
+    @patch("glauth.version", return_value="v1.0.0")
+    @patch("glauth.refresh_skip_reason", return_value=None)
+    @patch("glauth.refresh", return_value=None)
+    @patch("glauth.install", return_value=None)
+    def test_no_snap_change(self, *_) -> None:
+        """Test install and refresh complete at once when snapd has nothing to do."""
+        for event in (self.harness.charm.on.install, self.harness.charm.on.upgrade_charm):
+            with self.subTest(event=event.event_kind):
+                self.harness.charm.unit.status = MaintenanceStatus()
+                event.emit()
+                self.assertIsNone(self.harness.charm._stored.snap_change)
+                self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+                self.assertEqual(self.harness.get_workload_version(), "v1.0.0")
+
+    @patch("glauth.change_progress", side_effect=snap.SnapError("download failed"))
+    @patch("glauth.install", return_value="12")
+    def test_install_failed(self, *_) -> None:
+        """Test a failed snapd change blocks the unit."""
+        self.harness.charm.on.install.emit()
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.charm.unit.status, BlockedStatus("download failed"))
+
+    @patch("glauth.refresh")
+    @patch("glauth.refresh_skip_reason", return_value="revision 42 is already the latest")
+    def test_upgrade_no_op(self, _, refresh) -> None:
+        """Test upgrade-charm does not refresh an up-to-date snap."""
+        self.harness.charm.on.upgrade_charm.emit()
+        refresh.assert_not_called()
+        self.assertEqual(
+            self.harness.charm._stored.refresh_skipped, "revision 42 is already the latest"
+        )
+
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
+    @patch("glauth.version", return_value="v1.0.0")
+    def test_version_memoized(self, version, revision, _) -> None:
+        """Test the workload version is only looked up when the revision changes."""
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+        version.assert_called_once()
+        revision.return_value = "43"
+        version.return_value = "v1.0.1"
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.get_workload_version(), "v1.0.1")
+
+    @patch("glauth.load", return_value="cert")
+    def test_tls_key_type_changed(self, load) -> None:
+        """Test changing tls-key-type replaces a generated certificate."""
+        self.harness.update_config({"tls-key-type": "ecdsa-p256"})
+        load.assert_not_called()
+        self.harness.charm._stored.tls_key_type = "rsa-4096"
+        self.harness.update_config({"tls-key-type": "ecdsa-p384"})
+        load.assert_called_once_with(key_type="ecdsa-p384", regenerate=True)
+        self.assertEqual(self.harness.charm._stored.tls_key_type, "ecdsa-p384")
+        self.harness.update_config({"tls-key-type": "dsa"})
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
+    @patch("glauth.version", return_value="v1.0.0")
+    def test_hold_renewed_near_expiry(self, _, __, hold_refresh) -> None:
+        """Test update-status renews the refresh hold only when it is about to expire."""
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+        hold_refresh.assert_called_once_with(days=90, backend=snapd.SnapBackend.API)
+        self.harness.charm._stored.hold_expiry = time.time() + 6 * 86400
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(hold_refresh.call_count, 2)
+        self.harness.update_config({"refresh-hold-renew-days": 0})
+        self.harness.charm._stored.hold_expiry = time.time() + 3600
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(hold_refresh.call_count, 2)
+
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
+    @patch("glauth.version", return_value="v1.0.0")
+    @patch("probe.probe")
+    def test_probe_status(self, probe_ldap, *_) -> None:
+        """Test update-status reports LDAP latency, or waits while glauth does not answer."""
+        self.harness.charm._stored.glauth_state = {"config": "a", "listeners": "b", "tls": "c"}
+        probe_ldap.return_value = probe.ProbeResult(
+            [{"connect": 0.001, "search": 0.002}, {"connect": 0.001, "search": 0.004}]
+        )
+        self.harness.charm.on.update_status.emit()
+        probe_ldap.assert_called_once_with("127.0.0.1", 636, tls=True)
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus("ldap p50 4.0ms max 5.0ms"))
+        self.assertTrue(self.harness.charm._ldapclient._stored.server_ready)
+
+        probe_ldap.side_effect = probe.ProbeTimeoutError("no LDAP answer on port 636 within 2s")
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.charm.unit.status, WaitingStatus("no LDAP answer on port 636 within 2s")
+        )
+        self.assertFalse(self.harness.charm._ldapclient._stored.server_ready)
+        probe_ldap.side_effect = None
+        self.harness.charm.on.update_status.emit()
+        probe_ldap.side_effect = probe.ProbeError("unexpected LDAP response")
+        self.harness.charm.on.update_status.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.assertFalse(self.harness.charm._ldapclient._stored.server_ready)
+
+    @patch.dict("os.environ", {"JUJU_DISPATCH_PATH": "hooks/update-status"})
+    @patch("snapd.hold_refresh")
+    @patch("glauth.revision", return_value="42")
+    @patch("glauth.version", return_value="v1.0.0")
+    def test_hook_stats(self, *_) -> None:
+        """Test each hook is summarized and hook-stats reports percentiles per event."""
+        for _ in range(3):
+            self.harness.charm.on.update_status.emit()
+            subprocess.run(["true"])
+            self.harness.framework.on.pre_commit.emit()
+        record = self.harness.charm._stored.hook_stats[-1]
+        self.assertEqual(record["event"], "update-status")
+        self.assertIn("GlauthCharm._update_status", record["handlers"])
+        self.assertEqual(record["commands"], {"true": 1})
+
+        self.harness.charm._stored.hook_stats = [record] * instrumentation.WINDOW
+        self.harness.framework.on.pre_commit.emit()
+        self.assertEqual(len(self.harness.charm._stored.hook_stats), instrumentation.WINDOW)
+        results = self.harness.run_action("hook-stats").results
+        self.assertEqual(results["update-status"]["count"], str(instrumentation.WINDOW))
+        self.assertEqual(results["update-status"]["subprocess-p50"], "1")
+
+    @patch("profiling.top", return_value="ncalls  tottime  cumtime")
+    @patch("profiling.latest")
+    @patch("profiling.enable")
+    def test_profile_top(self, enable, latest, top) -> None:
+        """Test profile-hooks enables profiling and profile-top reads the last profile."""
+        self.harness.update_config({"profile-hooks": True})
+        enable.assert_called_with(self.harness.charm.charm_dir, 5.0)
+        latest.return_value = None
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("profile-top")
+        latest.return_value = pathlib.Path("1700000000-install.pstats")
+        results = self.harness.run_action("profile-top", {"count": 5}).results
+        self.assertEqual(results["file"], "1700000000-install.pstats")
+        top.assert_called_with(latest.return_value, 5)
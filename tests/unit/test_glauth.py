@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test glauth snap helpers."""
+
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import MagicMock, PropertyMock, patch
+
+import glauth
+import probe
+import snapd
+from charms.operator_libs_linux.v1 import snap
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from fake_snapd import FakeSnapd, sync
+
+
+class TestSnapCache(unittest.TestCase):
+    """Unit test the shared glauth snap cache."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        glauth.invalidate()
+        self.addCleanup(glauth.invalidate)
+
+    @patch("snapd.SnapCache")
+    def test_cache_reused(self, snap_cache) -> None:
+        """Test the snap cache is built once and reused until invalidated."""
+        before = glauth.cache_stats()
+        glauth.installed()
+        glauth.active()
+        self.assertEqual(snap_cache.call_count, 1)
+        glauth.invalidate()
+        glauth.installed()
+        self.assertEqual(snap_cache.call_count, 2)
+        after = glauth.cache_stats()
+        self.assertEqual(after["misses"] - before["misses"], 2)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    @patch("snapd.SnapCache")
+    def test_start_invalidates(self, snap_cache) -> None:
+        """Test starting glauth drops the cached snap state."""
+        snap_cache.return_value = {"glauth": MagicMock()}
+        glauth.start()
+        glauth.installed()
+        self.assertEqual(snap_cache.call_count, 2)
+
+    @patch("snapd.SnapCache")
+    def test_revision_from_symlink(self, snap_cache) -> None:
+        """Test the revision is read from the current symlink without asking snapd."""
+        with tempfile.TemporaryDirectory() as tmp:
+            current = os.path.join(tmp, "current")
+            os.symlink("42", current)
+            with patch("glauth.CURRENT_PATH", current):
+                self.assertEqual(glauth.revision(), "42")
+        snap_cache.assert_not_called()
+
+
+class TestRefresh(unittest.TestCase):
+    """Unit test skipping refreshes that would not change anything."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        glauth._store_revisions = None
+        self.addCleanup(setattr, glauth, "_store_revisions", None)
+        patcher = patch("glauth._snap_client")
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.client.get_snap_information.return_value = {
+            "channels": {"latest/edge": {"revision": "42"}, "latest/stable": {"revision": "40"}}
+        }
+
+    def _installed(self, channel: str, revision: str):
+        return snapd.Snap(
+            "glauth", snap.SnapState.Latest, channel, revision, "strict", snap_client=MagicMock()
+        )
+
+    def test_skip_latest(self) -> None:
+        """Test the refresh is skipped when the latest revision is installed."""
+        with patch("glauth._snap", return_value=self._installed("edge", "42")):
+            self.assertIn("42", glauth.refresh_skip_reason())
+            glauth.refresh_skip_reason()
+        self.client.get_snap_information.assert_called_once_with("glauth")
+
+    def test_refresh_needed(self) -> None:
+        """Test a refresh is needed for a new revision or a channel switch."""
+        with patch("glauth._snap", return_value=self._installed("latest/edge", "41")):
+            self.assertIsNone(glauth.refresh_skip_reason())
+        with patch("glauth._snap", return_value=self._installed("latest/stable", "42")):
+            self.assertIsNone(glauth.refresh_skip_reason())
+
+
+class TestAsyncInstall(unittest.TestCase):
+    """Unit test submitting the glauth snap install to a fake snapd."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        self.snapd = FakeSnapd(
+            {
+                ("GET", "/v2/find"): sync(
+                    [
+                        {
+                            "name": "glauth",
+                            "channel": "edge",
+                            "revision": "3",
+                            "confinement": "strict",
+                        }
+                    ]
+                ),
+                ("POST", "/v2/snaps/glauth"): (202, {"type": "async", "change": "12"}),
+            }
+        )
+        self.addCleanup(self.snapd.stop)
+        patcher = patch.object(
+            snapd.SnapCache, "snapd_installed", new_callable=PropertyMock, return_value=True
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        glauth._client = snapd.SnapClient(socket_path=self.snapd.socket_path)
+        glauth.invalidate()
+        self.addCleanup(setattr, glauth, "_client", None)
+        self.addCleanup(glauth.invalidate)
+
+    def _change(self, ready: bool, status: str, tasks) -> None:
+        self.snapd.routes[("GET", "/v2/changes/12")] = sync(
+            {"id": "12", "ready": ready, "status": status, "tasks": tasks, "err": "boom"}
+        )
+
+    def test_install_no_wait(self) -> None:
+        """Test install returns the change ID, then progress is polled until done."""
+        self.assertEqual(glauth.install(wait=False), "12")
+        self.assertIn(
+            ("POST", "/v2/snaps/glauth", "", {"action": "install", "channel": "latest/edge"}),
+            self.snapd.requests,
+        )
+        self._change(
+            False,
+            "Doing",
+            [
+                {"status": "Done", "summary": "Ensure prerequisites"},
+                {
+                    "status": "Doing",
+                    "summary": "Download snap",
+                    "progress": {"done": 25, "total": 100},
+                },
+                {"status": "Do", "summary": "Mount snap"},
+            ],
+        )
+        self.assertEqual(glauth.change_progress("12"), (False, "1/3 tasks, Download snap 25%"))
+        self._change(True, "Done", [])
+        self.assertTrue(glauth.change_progress("12")[0])
+
+    def test_install_error(self) -> None:
+        """Test a failed change is raised."""
+        self._change(True, "Error", [])
+        with self.assertRaises(snap.SnapError):
+            glauth.change_progress("12")
+
+
+class TestLoad(unittest.TestCase):
+    """Unit test generating the glauth TLS key and certificate."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cert = pathlib.Path(tmp.name, "certs.d", "glauth.crt")
+        self.key = pathlib.Path(tmp.name, "keys.d", "glauth.key")
+        for name, path in (("CERT_PATH", self.cert), ("KEY_PATH", self.key)):
+            patcher = patch.object(glauth, name, str(path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_key_types(self) -> None:
+        """Test each supported key type produces a matching self-signed certificate."""
+        expected = {"rsa-2048": rsa.RSAPublicKey, "ecdsa-p384": ec.EllipticCurvePublicKey}
+        expected["ed25519"] = ed25519.Ed25519PublicKey
+        for key_type, key_class in expected.items():
+            _, cert_pem = glauth.generate_certificate(key_type, "glauth-0")
+            cert = x509.load_pem_x509_certificate(cert_pem)
+            self.assertIsInstance(cert.public_key(), key_class)
+            self.assertEqual(cert.issuer, cert.subject)
+        with self.assertRaises(ValueError):
+            glauth.generate_certificate("dsa-1024", "glauth-0")
+
+    def test_load(self) -> None:
+        """Test load writes the key privately and reuses existing material."""
+        content = glauth.load(key_type="ecdsa-p256")
+        self.assertEqual(content, self.cert.read_text())
+        self.assertEqual(os.stat(self.key).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(self.cert).st_mode & 0o777, 0o644)
+        self.assertEqual(glauth.load(key_type="rsa-4096"), content)
+
+
+class TestRender(unittest.TestCase):
+    """Unit test rendering the glauth config."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config = pathlib.Path(tmp.name, "glauth.d", "glauth.cfg")
+        patcher = patch.object(glauth, "CONFIG_PATH", str(self.config))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = os.path.join(tmp.name, "cache")
+
+    def test_write_if_changed(self) -> None:
+        """Test the config is only rewritten when its content changes."""
+        self.assertTrue(glauth.create_default_config(5555, bytecode_cache_dir=self.cache))
+        self.assertIn('listen = "0.0.0.0:5555"', self.config.read_text())
+        os.utime(self.config, (0, 0))
+        self.assertFalse(glauth.create_default_config(5555, bytecode_cache_dir=self.cache))
+        self.assertEqual(self.config.stat().st_mtime, 0)
+        self.assertTrue(glauth.create_default_config(5556, bytecode_cache_dir=self.cache))
+        self.assertTrue(os.listdir(self.cache))
+
+
+class TestReconcile(unittest.TestCase):
+    """Unit test reloading or restarting glauth only when its config changed."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config = pathlib.Path(tmp.name, "glauth.d", "glauth.cfg")
+        self.config.parent.mkdir()
+        self.cert = pathlib.Path(tmp.name, "glauth.crt")
+        for name, path in (
+            ("CONFIG_PATH", self.config),
+            ("CERT_PATH", self.cert),
+            ("KEY_PATH", pathlib.Path(tmp.name, "glauth.key")),
+        ):
+            patcher = patch.object(glauth, name, str(path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for target in ("active", "start", "restart"):
+            patcher = patch.object(glauth, target)
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.active.return_value = True
+
+    def _write(self, port: int, users: str) -> None:
+        self.config.write_text(
+            f'[ldap]\nlisten = "0.0.0.0:{port}"\n\n[[users]]\nname = "{users}"\n'
+        )
+
+    def test_reconcile(self) -> None:
+        """Test the least disruptive action is taken for each kind of change."""
+        self._write(363, "alice")
+        _, applied = glauth.reconcile(None)
+        self.assertEqual(glauth.reconcile(applied), ("none", applied))
+
+        self._write(363, "bob")
+        action, applied = glauth.reconcile(applied)
+        self.assertEqual(action, "reload")
+        self.restart.assert_called_with(reload=True)
+
+        self._write(389, "bob")
+        action, applied = glauth.reconcile(applied)
+        self.assertEqual(action, "restart")
+        self.restart.assert_called_with()
+
+        self.cert.write_text("new certificate")
+        self.assertEqual(glauth.reconcile(applied)[0], "restart")
+
+        self.active.return_value = False
+        self.assertEqual(glauth.reconcile(applied)[0], "start")
+        self.start.assert_called_once()
+
+
+class TestWaitReady(unittest.TestCase):
+    """Unit test waiting for glauth to accept connections."""
+
+    @patch("time.sleep")
+    @patch("probe.sample")
+    @patch("glauth.active")
+    def test_backoff(self, active, sample, sleep) -> None:
+        """Test the daemon and LDAP port are polled with exponential backoff."""
+        active.side_effect = [False, True, True, True]
+        sample.side_effect = [
+            probe.ProbeUnreachableError("refused"),
+            probe.ProbeTimeoutError(""),
+            {},
+        ]
+        self.assertGreaterEqual(glauth.wait_ready(timeout=30), 0)
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.1, 0.2, 0.4])
+        sample.assert_called_with("127.0.0.1", 363, tls=False, timeout=2.0)
+
+        active.side_effect, sample.side_effect = None, None
+        glauth.wait_ready(tls=True, timeout=30)
+        sample.assert_called_with("127.0.0.1", 636, tls=True, timeout=2.0)
+
+    @patch("time.sleep")
+    @patch("glauth.active", return_value=False)
+    def test_timeout(self, *_) -> None:
+        """Test an inactive daemon times out."""
+        with self.assertRaisesRegex(TimeoutError, "daemon not active"):
+            glauth.wait_ready(timeout=0)
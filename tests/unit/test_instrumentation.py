@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the per-hook instrumentation."""
+
+import subprocess
+import unittest
+
+import instrumentation
+import snapd
+from fake_snapd import FakeSnapd, sync
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Unit test recording handlers, subprocesses and snapd requests."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        instrumentation.install()
+        instrumentation.summary()
+
+    def test_subprocess(self) -> None:
+        """Test nested subprocess helpers count once, with the output size."""
+        subprocess.check_output(["echo", "hello"])
+        subprocess.run("true", shell=True)
+        record = instrumentation.summary()
+        self.assertEqual(record["subprocess"]["calls"], 2)
+        self.assertEqual(record["subprocess"]["bytes"], len("hello\n"))
+        self.assertEqual(record["commands"], {"echo": 1, "true": 1})
+        self.assertEqual(instrumentation.summary()["subprocess"]["calls"], 0)
+
+    def test_snapd(self) -> None:
+        """Test snapd requests are counted with the bytes read."""
+        server = FakeSnapd({("GET", "/v2/snaps/glauth"): sync({"name": "glauth"})})
+        self.addCleanup(server.stop)
+        client = snapd.SnapClient(socket_path=server.socket_path)
+        self.addCleanup(client.close)
+        client.get_installed_snap_information("glauth")
+        client.get_installed_snap_information("glauth")
+        record = instrumentation.summary()
+        self.assertEqual(record["snapd"]["requests"], 2)
+        self.assertEqual(record["snapd"]["bytes"], client.stats["bytes"])
+
+    def test_handlers(self) -> None:
+        """Test wrapped handlers keep their name and are timed per class."""
+
+        @instrumentation.instrument("_on_event")
+        class Observer:
+            def _on_event(self, event):
+                return event
+
+        self.assertEqual(Observer._on_event.__name__, "_on_event")
+        self.assertEqual(Observer()._on_event(1), 1)
+        self.assertIn("Observer._on_event", instrumentation.summary()["handlers"])
+
+    def test_percentiles(self) -> None:
+        """Test hooks are summarized per event with nearest-rank percentiles."""
+        records = [
+            {
+                "event": "update-status",
+                "seconds": s / 10,
+                "subprocess": {"calls": 2},
+                "snapd": {"requests": 1},
+            }
+            for s in range(1, 11)
+        ]
+        records.append(
+            {
+                "event": "install",
+                "seconds": 5.0,
+                "subprocess": {"calls": 9},
+                "snapd": {"requests": 4},
+            }
+        )
+        result = instrumentation.percentiles(records)
+        self.assertEqual(
+            result["update-status"],
+            {
+                "count": "10",
+                "p50": "0.500",
+                "p90": "0.900",
+                "p99": "1.000",
+                "max": "1.000",
+                "subprocess-p50": "2",
+                "snapd-p50": "1",
+            },
+        )
+        self.assertEqual(result["install"]["p50"], "5.000")
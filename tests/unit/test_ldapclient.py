@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the ldap-client library."""
+
+import pathlib
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+import ldapclient_lib
+import probe
+from charm import GlauthCharm
+from ops.charm import CharmBase
+from ops.model import SecretNotFoundError, WaitingStatus
+from ops.testing import Harness
+
+
+class TestExtractConfig(unittest.TestCase):
+    """Unit test incremental extraction of the config resource."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        self.dest = self.tmp / "glauth.d"
+        self.manifest = self.tmp / "manifest.json"
+
+    def _archive(self, files: dict) -> pathlib.Path:
+        path = self.tmp / "config.zip"
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip:
+            for name, content in files.items():
+                zip.writestr(name, content)
+        return path
+
+    def _extract(self, files: dict, **kwargs) -> ldapclient_lib.ConfigChanges:
+        return ldapclient_lib.extract_config(
+            self._archive(files), str(self.dest), str(self.manifest), **kwargs
+        )
+
+    def test_incremental(self) -> None:
+        """Test only changed members are written and stale files are removed."""
+        changes = self._extract({"users.cfg": "a", "groups/ops.cfg": "b"})
+        self.assertEqual(sorted(changes.added), ["groups/ops.cfg", "users.cfg"])
+        self.assertEqual((self.dest / "groups" / "ops.cfg").read_text(), "b")
+
+        (self.dest / "glauth.cfg").write_text("default")
+        changes = self._extract({"users.cfg": "a", "groups/ops.cfg": "b"})
+        self.assertFalse(changes.changed)
+
+        changes = self._extract({"users.cfg": "c"})
+        self.assertEqual(changes, ([], ["users.cfg"], ["groups/ops.cfg"]))
+        self.assertFalse((self.dest / "groups" / "ops.cfg").exists())
+        self.assertEqual((self.dest / "users.cfg").read_text(), "c")
+        # Files that never came from the archive are left alone
+        self.assertTrue((self.dest / "glauth.cfg").exists())
+
+    def test_limits(self) -> None:
+        """Test oversized archives and paths escaping the config directory are refused."""
+        with self.assertRaises(ldapclient_lib.ConfigResourceError):
+            self._extract({"users.cfg": "x" * 1024}, max_size=1000)
+        with self.assertRaises(ldapclient_lib.ConfigResourceError):
+            self._extract({"../escape.cfg": "x"})
+        self.assertFalse((self.tmp / "escape.cfg").exists())
+
+
+class TestLdapClientProvides(unittest.TestCase):
+    """Unit test the provider side of the ldap-client relation."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        self.harness = Harness(GlauthCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.update_config({"ldap-search-base": "dc=glauth,dc=com"})
+        self.harness.begin()
+        self.peer = self.harness.add_relation("glauth", "glauth")
+        content = ldapclient_lib.credentials_content("cert", "cn=admin", "password")
+        secret = self.harness.charm.app.add_secret(content, label="ldap-credentials")
+        self.harness.update_relation_data(self.peer, "glauth", {"ldap-credentials": secret.id})
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cert = pathlib.Path(tmp.name, "glauth.crt")
+        for target, path in (
+            ("glauth.CERT_PATH", self.cert),
+            ("glauth.KEY_PATH", pathlib.Path(tmp.name, "glauth.key")),
+            ("ldapclient_lib.CERT_PATH", self.cert),
+        ):
+            patcher = patch(target, str(path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for target in (
+            "glauth.create_default_config",
+            "glauth.reconcile",
+            "glauth.wait_ready",
+            "ldapclient_lib.extract_config",
+            "probe.probe",
+        ):
+            patcher = patch(target)
+            setattr(self, target.split(".")[1], patcher.start())
+            self.addCleanup(patcher.stop)
+        self.probe.return_value = probe.ProbeResult([{"search": 0.001}])
+        self.extract_config.return_value = ldapclient_lib.ConfigChanges(["users.cfg"], [], [])
+        self.reconcile.return_value = ("start", {"config": "a", "listeners": "b", "tls": "c"})
+
+    def test_resource_applied_once(self) -> None:
+        """Test joining units reuse the config resource applied for the first one."""
+        self.harness.add_resource("config", b"config v1")
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        for unit in range(3):
+            self.harness.add_relation_unit(relation, f"sssd/{unit}")
+        self.extract_config.assert_called_once()
+        self.reconcile.assert_called_once()
+        provider = self.harness.charm._ldapclient
+        self.assertEqual(provider.resource_cache_stats, {"hits": 2, "misses": 1})
+
+        # A new resource revision, as resource-get would download it
+        self.harness.model.resources.fetch("config").write_bytes(b"config version 2")
+        self.harness.add_relation_unit(relation, "sssd/3")
+        self.assertEqual(self.extract_config.call_count, 2)
+        self.assertEqual(self.reconcile.call_count, 2)
+
+    def test_published_once_ready(self) -> None:
+        """Test relation data is withheld until glauth accepts connections."""
+        self.wait_ready.side_effect = TimeoutError("glauth not ready after 30s")
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        self.harness.add_relation_unit(relation, "sssd/0")
+        self.assertEqual(self.harness.get_relation_data(relation, "glauth"), {})
+        self.assertIsInstance(self.harness.charm.unit.status, WaitingStatus)
+        self.wait_ready.assert_called_with(tls=True)
+
+        with patch("glauth.revision", return_value="42"), patch(
+            "glauth.version", return_value="v2"
+        ), patch("snapd.hold_refresh"):
+            self.harness.charm.on.update_status.emit()
+        self.assertIn("ldap-uri", self.harness.get_relation_data(relation, "glauth"))
+
+    def test_withheld_while_unreachable(self) -> None:
+        """Test relation data is withheld while the advertised port does not answer."""
+        self.probe.side_effect = probe.ProbeUnreachableError("connection refused on port 636")
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        self.harness.add_relation_unit(relation, "sssd/0")
+        self.assertEqual(self.harness.get_relation_data(relation, "glauth"), {})
+        self.assertEqual(
+            self.harness.charm.unit.status, WaitingStatus("connection refused on port 636")
+        )
+
+    def test_relation_published_once(self) -> None:
+        """Test joining units leave the grants and relation data of current relations alone."""
+        relations = [self.harness.add_relation("ldap-client", f"sssd{i}") for i in range(3)]
+        for i, relation in enumerate(relations):
+            self.harness.add_relation_unit(relation, f"sssd{i}/0")
+        for relation in relations:
+            data = self.harness.get_relation_data(relation, "glauth")
+            self.assertEqual(data["basedn"], "dc=glauth,dc=com")
+            self.assertIn("ldap-uri", data)
+
+        with patch("ops.model.Secret.grant") as grant, patch(
+            "ops.model.RelationDataContent.update"
+        ) as update:
+            for unit in range(1, 4):
+                self.harness.add_relation_unit(relations[0], f"sssd0/{unit}")
+        grant.assert_not_called()
+        update.assert_not_called()
+        self.reconcile.assert_called_once()
+
+    def test_config_change_updates_all_relations(self) -> None:
+        """Test a config change is published to every relation without granting again."""
+        relations = [self.harness.add_relation("ldap-client", f"sssd{i}") for i in range(2)]
+        for i, relation in enumerate(relations):
+            self.harness.add_relation_unit(relation, f"sssd{i}/0")
+
+        with patch("ops.model.Secret.grant") as grant:
+            self.harness.update_config({"ldap-search-base": "dc=example,dc=com"})
+        grant.assert_not_called()
+        for relation in relations:
+            data = self.harness.get_relation_data(relation, "glauth")
+            self.assertEqual(data["basedn"], "dc=example,dc=com")
+
+    def test_certificate_reloads_glauth(self) -> None:
+        """Test a first or replaced certificate re-renders the config and reaches glauth."""
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        self.harness.add_relation_unit(relation, "sssd/0")
+        self.assertEqual(self.reconcile.call_count, 1)
+
+        params = {"ldap-default-bind-dn": "cn=admin", "ldap-password": "password"}
+        self.harness.run_action("set-confidential", params)
+        self.assertTrue(self.cert.exists())
+        self.assertEqual(self.create_default_config.call_count, 2)
+        self.assertEqual(self.reconcile.call_count, 2)
+
+        self.harness.update_config({"tls-key-type": "ecdsa-p256"})
+        self.assertEqual(self.create_default_config.call_count, 3)
+        self.assertEqual(self.reconcile.call_count, 3)
+        # The same certificate is not applied again
+        self.harness.add_relation_unit(relation, "sssd/1")
+        self.assertEqual(self.reconcile.call_count, 3)
+
+    def test_non_leader(self) -> None:
+        """Test a non-leader unit configures glauth but leaves the relation data alone."""
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        self.harness.add_relation_unit(relation, "sssd/0")
+        self.harness.set_leader(False)
+        self.harness.update_config({"ldap-search-base": "dc=example,dc=com"})
+        data = self.harness.get_relation_data(relation, "glauth")
+        self.assertEqual(data["basedn"], "dc=glauth,dc=com")
+
+        other = self.harness.add_relation("ldap-client", "other")
+        self.harness.add_relation_unit(other, "other/0")
+        self.assertEqual(self.harness.get_relation_data(other, "glauth"), {})
+
+    def test_relation_broken_keeps_secrets(self) -> None:
+        """Test breaking one relation only revokes its grants."""
+        sssd = self.harness.add_relation("ldap-client", "sssd")
+        other = self.harness.add_relation("ldap-client", "other")
+        for relation, unit in ((sssd, "sssd/0"), (other, "other/0")):
+            self.harness.add_relation_unit(relation, unit)
+        secret_id = self.harness.get_relation_data(other, "glauth")["ldap-credentials"]
+
+        self.harness.remove_relation(sssd)
+        secret = self.harness.model.get_secret(label="ldap-credentials")
+        self.assertEqual(secret.peek_content()["ldap-password"], "password")
+        self.assertEqual(self.harness.get_secret_grants(secret_id, sssd), set())
+        self.assertEqual(self.harness.get_secret_grants(secret_id, other), {"other"})
+
+    def test_legacy_secrets(self) -> None:
+        """Test the per-field secrets of older releases are shared until bundled."""
+        self.harness.model.get_secret(label="ldap-credentials").remove_all_revisions()
+        legacy = {}
+        for label in ldapclient_lib.SECRET_KEYS:
+            legacy[label] = self.harness.charm.app.add_secret({label: "value"}, label=label).id
+        self.harness.update_relation_data(self.peer, "glauth", {"ldap-credentials": "", **legacy})
+        relation = self.harness.add_relation("ldap-client", "sssd")
+        self.harness.add_relation_unit(relation, "sssd/0")
+        data = self.harness.get_relation_data(relation, "glauth")
+        self.assertNotIn("ldap-credentials", data)
+        self.assertEqual({key: data[key] for key in legacy}, legacy)
+
+        action = self.harness.run_action(
+            "set-confidential",
+            {"ca-cert": "cert", "ldap-default-bind-dn": "cn=admin", "ldap-password": "pw"},
+        )
+        self.assertEqual(action.results, {})
+        data = self.harness.get_relation_data(relation, "glauth")
+        self.assertEqual(set(data), {"ldap-credentials", "basedn", "ldap-uri"})
+        secret = self.harness.model.get_secret(id=data["ldap-credentials"])
+        self.assertEqual(secret.peek_content()["ldap-password"], "pw")
+        for label in ldapclient_lib.SECRET_KEYS:
+            with self.assertRaises(SecretNotFoundError):
+                self.harness.model.get_secret(label=label)
+
+    def test_set_confidential_rotates_in_place(self) -> None:
+        """Test re-running set-confidential revises the secret only when content differs."""
+        secret_id = self.harness.get_relation_data(self.peer, "glauth")["ldap-credentials"]
+        params = {"ca-cert": "cert", "ldap-default-bind-dn": "cn=admin", "ldap-password": "pw"}
+        self.harness.run_action("set-confidential", params)
+        self.harness.run_action("set-confidential", params)
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [1, 2])
+        self.harness.run_action("set-confidential", {**params, "ldap-password": "rotated"})
+        self.assertEqual(self.harness.get_secret_revisions(secret_id), [1, 2, 3])
+        data = self.harness.get_relation_data(self.peer, "glauth")
+        self.assertEqual(data["ldap-credentials"], secret_id)
+
+
+class _RequirerCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ldap = ldapclient_lib.LdapClientRequires(self, "ldap-client")
+        self.events = []
+        self.defer = False
+        self.framework.observe(self.ldap.on.certificate_available, self._record)
+        self.framework.observe(self.ldap.on.config_data_available, self._record)
+
+    def _record(self, event) -> None:
+        if self.defer:
+            event.defer()
+            return
+        self.events.append(event)
+
+
+class TestLdapClientRequires(unittest.TestCase):
+    """Unit test the requirer side of the ldap-client relation."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        self.harness = Harness(
+            _RequirerCharm, meta="{name: sssd, requires: {ldap-client: {interface: ldap}}}"
+        )
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.events = self.harness.charm.events
+
+    def _relate(self, contents: dict) -> dict:
+        """Relate to glauth, sharing each content dict as a secret under its key."""
+        relation = self.harness.add_relation("ldap-client", "glauth")
+        self.harness.add_relation_unit(relation, "glauth/0")
+        data = {"basedn": "dc=glauth,dc=com", "ldap-uri": "ldap://glauth"}
+        for key, content in contents.items():
+            data[key] = self.harness.add_model_secret("glauth", content)
+            self.harness.grant_secret(data[key], "sssd")
+        self.harness.update_relation_data(relation, "glauth", data)
+        self.relation = relation
+        return data
+
+    def _assert_emitted(self) -> None:
+        ca, config = self.events[-2:]
+        self.assertEqual(ca.ca_cert, "cert")
+        self.assertEqual((config.ldbd_content, config.lp_content), ("cn=admin", "password"))
+
+    def test_bundled_secret(self) -> None:
+        """Test the credentials are read from the ldap-credentials secret."""
+        content = ldapclient_lib.credentials_content("cert", "cn=admin", "password")
+        self._relate({"ldap-credentials": content})
+        self._assert_emitted()
+
+    def test_legacy_secrets(self) -> None:
+        """Test the credentials are read from per-field secrets of older providers."""
+        values = {
+            "ca-cert": "cert",
+            "ldap-default-bind-dn": "cn=admin",
+            "ldap-password": "password",
+        }
+        self._relate({key: {key: value} for key, value in values.items()})
+        self._assert_emitted()
+
+    def test_secrets_read_once(self) -> None:
+        """Test each shared secret is read once per hook, by the library and observers alike."""
+        values = {
+            "ca-cert": "cert",
+            "ldap-default-bind-dn": "cn=admin",
+            "ldap-password": "password",
+        }
+        bundled = {"ldap-credentials": ldapclient_lib.credentials_content(*values.values())}
+        legacy = {key: {key: value} for key, value in values.items()}
+        backend = self.harness._backend
+        for contents in (bundled, legacy):
+            with self.subTest(secrets=list(contents)):
+                with patch.object(backend, "secret_get", wraps=backend.secret_get) as secret_get:
+                    self._relate(contents)
+                    self._assert_emitted()
+                self.assertEqual(secret_get.call_count, len(contents))
+
+    def test_rotation(self) -> None:
+        """Test a new revision of the credentials is picked up on secret-changed."""
+        content = ldapclient_lib.credentials_content("cert", "cn=admin", "password")
+        secret_id = self._relate({"ldap-credentials": content})["ldap-credentials"]
+        emitted = dict(self.harness.charm.ldap._stored.emitted)
+        self.harness.set_secret_content(secret_id, {**content, "ldap-password": "rotated"})
+        self.assertEqual(self.events[-1].lp_content, "rotated")
+        # Nothing derived from the secret content is kept across hooks
+        self.assertEqual(dict(self.harness.charm.ldap._stored.emitted), emitted)
+
+    def test_unchanged_data_not_emitted(self) -> None:
+        """Test relation-changed only emits, and reads secrets, when the payload changed."""
+        content = ldapclient_lib.credentials_content("cert", "cn=admin", "password")
+        self._relate({"ldap-credentials": content})
+        emitted = len(self.events)
+        with patch.object(self.harness.model, "get_secret") as get_secret:
+            self.harness.update_relation_data(self.relation, "glauth/0", {"ingress": "10.0.0.1"})
+            get_secret.assert_not_called()
+        self.assertEqual(len(self.events), emitted)
+
+        self.harness.update_relation_data(self.relation, "glauth", {"basedn": "dc=example"})
+        self.assertEqual(self.events[-1].basedn, "dc=example")
+
+    def test_deferred_snapshot(self) -> None:
+        """Test deferred events store secret IDs only and read the content when restored."""
+        self.harness.charm.defer = True
+        content = ldapclient_lib.credentials_content("cert", "cn=admin", "password")
+        secret_id = self._relate({"ldap-credentials": content})["ldap-credentials"]
+        snapshots = [
+            self.harness.framework._storage.load_snapshot(handle)
+            for handle, _, _ in self.harness.framework._storage.notices()
+        ]
+        self.assertIn({"ca_cert_secret": secret_id}, snapshots)
+        self.assertNotIn("password", str(snapshots))
+
+        self.harness.charm.defer = False
+        self.harness.framework.reemit()
+        self._assert_emitted()
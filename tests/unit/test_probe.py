@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the LDAP liveness probe against a local stand-in listener."""
+
+import os
+import socket
+import socketserver
+import ssl
+import tempfile
+import threading
+import unittest
+
+import glauth
+import probe
+
+# A root DSE entry with no attributes, then success
+ENTRY = probe._message(1, probe._tlv(probe.SEARCH_RESULT_ENTRY, b"\x04\x00\x30\x00"))
+DONE = probe._message(1, probe._tlv(probe.SEARCH_RESULT_DONE, b"\x0a\x01\x00\x04\x00\x04\x00"))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        request = self.request.recv(4096)
+        self.server.requests.append(request)
+        if self.server.reply is not None:
+            # Split the reply to exercise reassembly
+            for i in range(0, len(self.server.reply), 5):
+                self.request.sendall(self.server.reply[i : i + 5])
+        else:
+            self.server.hang.wait()
+
+
+class _StandIn(socketserver.ThreadingTCPServer):
+    """Answer any request with a canned reply, or never answer at all."""
+
+    daemon_threads = True
+
+    def __init__(self, reply, context=None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.reply = reply
+        self.requests = []
+        self.hang = threading.Event()
+        if context is not None:
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def stop(self) -> None:
+        self.hang.set()
+        self.shutdown()
+        self.server_close()
+
+
+class TestProbe(unittest.TestCase):
+    """Unit test the LDAP liveness probe."""
+
+    def _serve(self, reply, context=None) -> _StandIn:
+        server = _StandIn(reply, context)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_root_dse(self) -> None:
+        """Test a search is timed and answered on a plain LDAP port."""
+        server = self._serve(ENTRY + DONE)
+        result = probe.probe("127.0.0.1", server.port, samples=3)
+        self.assertEqual(len(result.samples), 3)
+        self.assertEqual(set(result.samples[0]), {"connect", "search"})
+        self.assertLessEqual(result.p50, result.max)
+        self.assertEqual(server.requests[0], probe.ROOT_DSE_REQUEST)
+        # LDAPMessage, messageID 1, SearchRequest of "" with scope baseObject
+        self.assertEqual(probe.ROOT_DSE_REQUEST[:9].hex(), "302502010163200400")
+
+    def test_ldaps(self) -> None:
+        """Test the TLS handshake is timed on an LDAPS port."""
+        key, cert = glauth.generate_certificate("ecdsa-p256", "localhost")
+        with tempfile.TemporaryDirectory() as tmp:
+            key_path, cert_path = os.path.join(tmp, "key.pem"), os.path.join(tmp, "cert.pem")
+            with open(key_path, "wb") as f:
+                f.write(key)
+            with open(cert_path, "wb") as f:
+                f.write(cert)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_path, key_path)
+        server = self._serve(ENTRY + DONE, context)
+        result = probe.probe("127.0.0.1", server.port, tls=True, samples=1)
+        self.assertEqual(set(result.samples[0]), {"connect", "tls", "search"})
+
+    def test_timeout(self) -> None:
+        """Test a listener that never answers times out."""
+        server = self._serve(None)
+        with self.assertRaises(probe.ProbeTimeoutError):
+            probe.probe("127.0.0.1", server.port, samples=1, timeout=0.2)
+
+    def test_refused(self) -> None:
+        """Test a closed port is reported as unreachable."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        with self.assertRaises(probe.ProbeUnreachableError):
+            probe.probe("127.0.0.1", port, samples=1)
+
+    def test_not_ldap(self) -> None:
+        """Test a listener answering something else than LDAP is an error."""
+        server = self._serve(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+        with self.assertRaises(probe.ProbeError) as ctx:
+            probe.probe("127.0.0.1", server.port, samples=1)
+        self.assertNotIsInstance(ctx.exception, probe.ProbeUnreachableError)
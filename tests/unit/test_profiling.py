@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the opt-in profiling of slow hooks."""
+
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import profiling
+
+
+def _slow_hook(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class TestProfiling(unittest.TestCase):
+    """Unit test profiling hooks into a bounded ring directory."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = pathlib.Path(tmp.name)
+        patcher = patch.dict(
+            os.environ, {"JUJU_CHARM_DIR": tmp.name, "JUJU_DISPATCH_PATH": "hooks/install"}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(profiling.ENV_VAR, None)
+
+    def test_disabled(self) -> None:
+        """Test nothing is profiled without the marker or environment variable."""
+        profiling.run(_slow_hook, 0.01)
+        self.assertIsNone(profiling.latest(self.dir))
+
+    def test_threshold(self) -> None:
+        """Test only hooks slower than the threshold keep their profile."""
+        profiling.enable(self.dir, 0.05)
+        profiling.run(_slow_hook, 0)
+        self.assertIsNone(profiling.latest(self.dir))
+        profiling.run(_slow_hook, 0.06)
+        path = profiling.latest(self.dir)
+        self.assertTrue(path.name.endswith("-install.pstats"))
+        self.assertIn("_slow_hook", profiling.top(path, 5))
+
+        profiling.enable(self.dir, None)
+        with patch.dict(os.environ, {profiling.ENV_VAR: "0"}):
+            profiling.run(_slow_hook, 0)
+        self.assertNotEqual(profiling.latest(self.dir), path)
+
+    @patch("profiling.MAX_FILES", 3)
+    def test_ring(self) -> None:
+        """Test the oldest profiles are dropped beyond the bounds of the directory."""
+        profiling.enable(self.dir, 0)
+        for _ in range(5):
+            profiling.run(_slow_hook, 0)
+        self.assertEqual(len(list((self.dir / profiling.PROFILES_DIR).iterdir())), 3)
+        with patch("profiling.MAX_BYTES", 0):
+            profiling.run(_slow_hook, 0)
+        self.assertEqual(list((self.dir / profiling.PROFILES_DIR).iterdir()), [])
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Test the snapd API backend and snap cache."""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import PropertyMock, patch
+
+import snapd
+from charms.operator_libs_linux.v1 import snap
+from fake_snapd import FakeSnapd, sync
+
+
+class TestSnapCache(unittest.TestCase):
+    """Unit test loading snaps into the cache."""
+
+    @patch.object(snapd.SnapCache, "snapd_installed", new_callable=PropertyMock, return_value=True)
+    @patch("snapd.SnapClient")
+    def test_targeted_load(self, snap_client, _) -> None:
+        """Test a named cache only asks snapd about the snaps it tracks."""
+        client = snap_client.return_value
+        client.get_installed_snap_information.return_value = {
+            "name": "glauth",
+            "channel": "latest/edge",
+            "revision": "42",
+            "confinement": "strict",
+            "version": "v2.2.0",
+        }
+        cache = snapd.SnapCache(names=["glauth"])
+        self.assertIn("glauth", cache)
+        self.assertNotIn("juju", cache)
+        self.assertEqual(cache["glauth"].revision, "42")
+        self.assertEqual(cache["glauth"].version, "v2.2.0")
+        self.assertTrue(cache["glauth"].present)
+        client.get_installed_snaps.assert_not_called()
+        client.get_installed_snap_information.assert_called_once_with("glauth")
+
+
+class TestSnapCatalog(unittest.TestCase):
+    """Unit test lookups in the mmap-backed names catalog."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "names")
+        patcher = patch.dict(snapd._SnapCatalog._catalogs, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _catalog(self, content: bytes) -> snapd._SnapCatalog:
+        with open(self.path, "wb") as f:
+            f.write(content)
+        return snapd._SnapCatalog.load(self.path)
+
+    def test_lookup(self) -> None:
+        """Test hits and misses across the catalog, with and without a trailing newline."""
+        for content in (b"bar\nfoo\nglauth\nlxd\nzsh\n", b"bar\nfoo\nglauth\nlxd\nzsh"):
+            with self.subTest(content=content):
+                catalog = self._catalog(content)
+                for name in ("bar", "foo", "glauth", "lxd", "zsh"):
+                    self.assertIn(name, catalog)
+                for name in ("aaa", "ba", "bars", "go", "juju", "zs", "zzz", ""):
+                    self.assertNotIn(name, catalog)
+                self.assertEqual(list(catalog), ["bar", "foo", "glauth", "lxd", "zsh"])
+                self.assertEqual(len(catalog), 5)
+
+    def test_single_name(self) -> None:
+        """Test a catalog holding one name."""
+        catalog = self._catalog(b"glauth\n")
+        self.assertIn("glauth", catalog)
+        self.assertNotIn("foo", catalog)
+        self.assertNotIn("lxd", catalog)
+        self.assertEqual(list(catalog), ["glauth"])
+        self.assertEqual(len(catalog), 1)
+
+    def test_empty(self) -> None:
+        """Test an empty catalog contains nothing."""
+        catalog = self._catalog(b"")
+        self.assertNotIn("glauth", catalog)
+        self.assertEqual(list(catalog), [])
+        self.assertEqual(len(catalog), 0)
+
+    def test_missing(self) -> None:
+        """Test there is no catalog when snapd has not written one."""
+        self.assertIsNone(snapd._SnapCatalog.load(self.path))
+
+    def test_reload(self) -> None:
+        """Test the catalog is reused while the file is unchanged and rebuilt when it changes."""
+        catalog = self._catalog(b"foo\nglauth\n")
+        self.assertIs(snapd._SnapCatalog.load(self.path), catalog)
+
+        with open(self.path, "wb") as f:
+            f.write(b"juju\nlxd\n")
+        mtime = catalog.mtime + 1_000_000_000
+        os.utime(self.path, ns=(mtime, mtime))
+
+        reloaded = snapd._SnapCatalog.load(self.path)
+        self.assertIsNot(reloaded, catalog)
+        self.assertEqual(reloaded.mtime, mtime)
+        self.assertIn("lxd", reloaded)
+        self.assertNotIn("glauth", reloaded)
+        self.assertEqual(len(reloaded), 2)
+
+
+class TestSnapClient(unittest.TestCase):
+    """Unit test the snapd client against a fake snapd socket."""
+
+    def setUp(self) -> None:
+        """Set up unit test."""
+        self.snapd = FakeSnapd({("GET", "/v2/snaps/glauth"): sync({"name": "glauth"})})
+        self.addCleanup(self.snapd.stop)
+        self.client = snapd.SnapClient(socket_path=self.snapd.socket_path)
+        self.addCleanup(self.client.close)
+
+    def test_keep_alive(self) -> None:
+        """Test consecutive requests share one connection."""
+        for _ in range(3):
+            self.assertEqual(
+                self.client.get_installed_snap_information("glauth")["name"], "glauth"
+            )
+        self.assertEqual(self.snapd.connections, 1)
+        self.assertEqual(self.client.stats["connects"], 1)
+        self.assertEqual(self.client.stats["requests"], 3)
+
+    def test_reconnect(self) -> None:
+        """Test the client reconnects when snapd drops the connection."""
+        self.snapd.drop_connections = True
+        self.client.get_installed_snap_information("glauth")
+        self.client.get_installed_snap_information("glauth")
+        self.assertEqual(self.snapd.connections, 2)
+
+    def test_reconnect_idle(self) -> None:
+        """Test a request is not written into a connection snapd has already closed."""
+        self.snapd.routes[("POST", "/v2/snaps/glauth")] = (202, {"type": "async", "change": "7"})
+        self.snapd.drop_connections = True
+        self.client.get_installed_snap_information("glauth")
+        deadline = time.monotonic() + 5
+        while not self.client._dropped() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.client.snap_action("glauth", "install"), "7")
+        self.assertEqual(self.snapd.connections, 2)
+
+    def test_no_resend(self) -> None:
+        """Test a request snapd may have acted on is not sent twice."""
+        self.snapd.routes[("POST", "/v2/snaps/glauth")] = (None, {})
+        self.client.get_installed_snap_information("glauth")
+        with self.assertRaises(snap.SnapAPIError):
+            self.client.snap_action("glauth", "install")
+        posts = [r for r in self.snapd.requests if r[0] == "POST"]
+        self.assertEqual(len(posts), 1)
+
+    def test_error(self) -> None:
+        """Test error responses are raised as SnapAPIError."""
+        with self.assertRaises(snap.SnapAPIError) as e:
+            self.client.get_installed_snap_information("juju")
+        self.assertEqual(e.exception.code, 404)
+        self.client.get_installed_snap_information("glauth")
+        self.assertEqual(self.snapd.connections, 1)
+
+    def test_api_backend(self) -> None:
+        """Test snap operations can be carried out through the snapd API."""
+        self.snapd.routes.update(
+            {
+                ("POST", "/v2/snaps/glauth"): (202, {"type": "async", "change": "7"}),
+                ("POST", "/v2/apps"): (202, {"type": "async", "change": "8"}),
+                ("GET", "/v2/changes/7"): sync({"id": "7", "ready": True, "status": "Done"}),
+                ("GET", "/v2/changes/8"): sync({"id": "8", "ready": True, "status": "Error"}),
+            }
+        )
+        glauth_snap = snapd.Snap(
+            "glauth", snap.SnapState.Available, "stable", "1", "strict", snap_client=self.client
+        )
+        glauth_snap.ensure(snap.SnapState.Latest, channel="edge", backend=snapd.SnapBackend.API)
+        self.assertIn(
+            ("POST", "/v2/snaps/glauth", "", {"action": "install", "channel": "edge"}),
+            self.snapd.requests,
+        )
+        with self.assertRaises(snap.SnapError):
+            glauth_snap.start(["daemon"], enable=True, backend=snapd.SnapBackend.API)
+        self.assertIn(
+            (
+                "POST",
+                "/v2/apps",
+                "",
+                {"action": "start", "names": ["glauth.daemon"], "enable": True},
+            ),
+            self.snapd.requests,
+        )